@@ -1,2 +1,120 @@
 # Constants
-GPT_MODEL = "gpt-4o"
\ No newline at end of file
+GPT_MODEL = "gpt-4o"
+
+# Maximum number of analysis stages of a case that run at the same time
+MAX_CONCURRENT_STAGES = 6
+
+# On-disk response cache (set RESPONSE_CACHE=off in .env to bypass it)
+CACHE_PATH = ".cache/responses.sqlite3"
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+
+# Chunked transcript review
+TRANSCRIPT_CHUNK_CHARS = 48000
+TRANSCRIPT_CHUNK_OVERLAP_LINES = 10
+TRANSCRIPT_CHUNK_MAX_TOKENS = 4000
+TRANSCRIPT_REDUCE_FANIN = 8
+
+# Transcript compaction (set TRANSCRIPT_COMPACTION=off in .env to send transcripts as they are):
+# lines repeated within BOILERPLATE_EDGE_LINES of the top or bottom of a page on at least
+# BOILERPLATE_MIN_PAGES pages and BOILERPLATE_PAGE_FRACTION of the first BOILERPLATE_SAMPLE_PAGES
+# pages are running headers or footers
+BOILERPLATE_EDGE_LINES = 3
+BOILERPLATE_MIN_PAGES = 3
+BOILERPLATE_PAGE_FRACTION = 0.3
+BOILERPLATE_SAMPLE_PAGES = 100
+COMPACT_MAX_TURN_CHARS = 2000
+# A court-reporter certification ends at the next speaker turn, blank line or page, and
+# after at most CERTIFICATE_MAX_LINES lines
+CERTIFICATE_MAX_LINES = 12
+
+# Transcript retrieval (set TRANSCRIPT_RETRIEVAL=on in .env): BM25 index over passages of
+# PASSAGE_LINES lines; the review is sent the PASSAGE_TOP_K best matching passages
+PASSAGE_INDEX_DIR = ".cache/passages"
+PASSAGE_LINES = 12
+PASSAGE_OVERLAP_LINES = 4
+PASSAGE_TOP_K = 40
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Responses cut off by the length limit are continued with up to MAX_CONTINUATIONS further
+# requests, each sent the last CONTINUATION_TAIL_CHARS characters of the text so far. Where a
+# continuation starts by repeating up to CONTINUATION_OVERLAP_CHARS characters of that text, the
+# repeat is dropped; repeats shorter than CONTINUATION_MIN_OVERLAP_CHARS are kept.
+MAX_CONTINUATIONS = 3
+CONTINUATION_TAIL_CHARS = 2000
+CONTINUATION_OVERLAP_CHARS = 400
+CONTINUATION_MIN_OVERLAP_CHARS = 20
+
+# Stored statute and standard-of-review sections shared by every case (see knowledge.py);
+# keep the directory under version control to review changes after a refresh
+KNOWLEDGE_DIR = "knowledge"
+KNOWLEDGE_MAX_TOKENS = 2000
+
+# Streaming document writer: paragraphs between intermediate saves; the interval grows with
+# the document so that the saves, which rewrite the whole file, stay linear in its size
+SAVE_EVERY_PARAGRAPHS = 50
+# Streaming mode: characters of each stage's output buffered in memory while earlier stages
+# are written; the rest is spilled to a temporary file
+STREAM_BUFFER_CHARS = 200000
+
+# Shared request scheduler: account limits and retry policy
+REQUESTS_PER_MINUTE = 5000
+TOKENS_PER_MINUTE = 450000
+MAX_RETRIES = 6
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# Lower numbers are sent first when requests queue for budget
+DEFAULT_PRIORITY = 10
+CRITICAL_PATH_PRIORITY = 0
+
+# Global cap on model requests in flight across all cases of a batch
+MAX_CONCURRENT_REQUESTS = 16
+
+# Hedged requests: for the stages in HEDGE_STAGES, a duplicate request is sent when no text
+# has arrived after HEDGE_FIRST_TOKEN_SECONDS or the response stalls for HEDGE_STALL_SECONDS;
+# the first to finish wins. At most HEDGE_MAX_FRACTION of all requests are hedges.
+# Set HEDGE_FALLBACK_MODEL (e.g. "gpt-4o-mini") to send the duplicate to another model.
+# Hedged attempts fail after HEDGE_REQUEST_TIMEOUT seconds without data from the API, so a
+# cancelled attempt stuck before its first chunk frees its request slot.
+HEDGE_STAGES = ("errors", "standard_of_review")
+HEDGE_FIRST_TOKEN_SECONDS = 30.0
+HEDGE_STALL_SECONDS = 30.0
+HEDGE_FALLBACK_MODEL = None
+HEDGE_MAX_FRACTION = 0.05
+HEDGE_REQUEST_TIMEOUT = 90.0
+
+# Batch mode
+BATCH_WORKERS = 4
+BATCH_OUTPUT_DIR = "output"
+CHECKPOINT_DIR = ".checkpoints"
+
+# Context window and output limit per model, in tokens
+MODEL_LIMITS = {
+    "gpt-4o-mini": {"context_window": 128000, "max_output_tokens": 16384},
+    "gpt-4o": {"context_window": 128000, "max_output_tokens": 16384},
+    "gpt-4-turbo": {"context_window": 128000, "max_output_tokens": 4096},
+    "gpt-4": {"context_window": 8192, "max_output_tokens": 8192},
+    "gpt-3.5-turbo": {"context_window": 16385, "max_output_tokens": 4096},
+}
+DEFAULT_MODEL_LIMITS = {"context_window": 8192, "max_output_tokens": 4096}
+# Requests that cannot leave this many tokens for the response are rejected before sending
+MIN_OUTPUT_TOKENS = 1024
+CONTEXT_SAFETY_MARGIN = 64
+
+# Estimated price in USD per million tokens, used for the cost in telemetry reports
+MODEL_PRICING = {
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "output": 10.00},
+    "gpt-4-turbo": {"input": 10.00, "output": 30.00},
+    "gpt-4": {"input": 30.00, "output": 60.00},
+    "gpt-3.5-turbo": {"input": 0.50, "output": 1.50},
+}
+# Telemetry keeps the most recent TELEMETRY_MAX_SPANS spans for reports and latency quantiles;
+# counts, sums and counters cover every span since startup
+TELEMETRY_MAX_SPANS = 100000
+
+# Service mode: finished jobs beyond the most recent SERVICE_MAX_FINISHED_JOBS are forgotten
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8080
+SERVICE_MAX_FINISHED_JOBS = 1000
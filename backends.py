@@ -0,0 +1,203 @@
+import itertools
+import os
+import random
+import threading
+import time
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+from Constants import MAX_CONCURRENT_REQUESTS
+
+
+class OpenAIBackend:
+    """
+    Backend that sends requests to the OpenAI ChatCompletion API.
+
+    All requests share one pooled, keep-alive HTTP session, so a long-running
+    process reuses its connections instead of opening one per request.
+
+    Args:
+        api_key (str): API key; defaults to OPENAI_API_KEY.
+        api_base (str): Endpoint base URL; defaults to OPENAI_API_BASE or the OpenAI API.
+        pool_size (int): Maximum number of pooled connections.
+    """
+
+    def __init__(self, api_key=None, api_base=None, pool_size=MAX_CONCURRENT_REQUESTS):
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.api_base = api_base or os.getenv("OPENAI_API_BASE") or openai.api_base
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        openai.requestssession = self.session
+
+    def create(self, **params):
+        return openai.ChatCompletion.create(api_key=self.api_key, api_base=self.api_base, **params)
+
+
+class FakeBackend:
+    """
+    In-process stand-in for the ChatCompletion API, for offline tests and benchmarks.
+
+    Replies are Markdown text shaped like the stage outputs. Latency, generation
+    speed, streaming and failures are simulated; failures raise the same openai.error
+    exceptions as the real API, so retries and error handling are exercised.
+
+    Args:
+        latency (float): Seconds before the first token of a response.
+        tokens_per_second (float): Generation speed after the first token.
+        completion_tokens (int): Length of a full reply; replies are truncated to max_tokens. A request
+                                 whose last assistant message quotes the end of a truncated
+                                 reply is answered with the rest of that reply.
+        rate_limit_rate (float): Fraction of requests answered with a 429 RateLimitError.
+        timeout_rate (float): Fraction of requests that stall and then raise Timeout.
+        timeout_after (float): Seconds a timing-out request stalls before failing.
+        retry_after (float): Retry-After value sent with simulated 429s, or None.
+        slow_rate (float): Fraction of requests that stall before their first token (the long tail).
+        slow_latency (float): Seconds a slow request waits before its first token. A request
+                              sent with a shorter request_timeout raises Timeout after it.
+        seed (int): Seed for the failure and reply generator.
+    """
+
+    def __init__(self, latency=0.05, tokens_per_second=500.0, completion_tokens=400, rate_limit_rate=0.0,
+                 timeout_rate=0.0, timeout_after=0.5, retry_after=0.1, slow_rate=0.0, slow_latency=5.0, seed=None):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_after = timeout_after
+        self.retry_after = retry_after
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.calls = 0
+        self.rate_limited = 0
+        self.timed_out = 0
+        self.slow = 0
+        self.cancelled = 0
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        with self._lock:
+            self.calls += 1
+            roll = self._random.random()
+            if roll < self.rate_limit_rate:
+                self.rate_limited += 1
+                return "rate_limit"
+            if roll < self.rate_limit_rate + self.timeout_rate:
+                self.timed_out += 1
+                return "timeout"
+            if self.slow_rate and self._random.random() < self.slow_rate:
+                self.slow += 1
+                return "slow"
+        return None
+
+    def _fail(self, failure):
+        if failure == "rate_limit":
+            headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+            raise openai.error.RateLimitError("Simulated rate limit", http_status=429, headers=headers)
+        time.sleep(self.timeout_after)
+        raise openai.error.Timeout("Simulated request timeout")
+
+    @staticmethod
+    def reply_tokens(count):
+        """Build a Markdown reply of `count` word tokens."""
+        words = []
+        section = 0
+        while len(words) < count:
+            section += 1
+            words += ["\n\n##", "Finding", f"{section}\n\n1.", "**Issue:**", "The", "hearing", "officer"]
+            words += ["did", "not", "weigh", "the", "independent", "evaluation", "of", "the", "student.\n"]
+            words += ["-", "Testimony", "at", f"{section}:{section % 25 + 1}", "was", "undervalued.\n"]
+        return words[:count]
+
+    def _reply(self, messages):
+        words = self.reply_tokens(self.completion_tokens)
+        if len(messages) > 1 and messages[-2]["role"] == "assistant":
+            # A continuation: reply with what follows the quoted text, starting with the joining space.
+            reply = " ".join(words)
+            tail = messages[-2]["content"]
+            at = reply.find(tail)
+            if tail and at >= 0:
+                return reply[at + len(tail):].split(" ")
+        return words
+
+    def create(self, model, messages, temperature=None, max_tokens=None, stream=False, **kwargs):
+        failure = self._roll()
+        if failure in ("rate_limit", "timeout"):
+            self._fail(failure)
+        latency = self.slow_latency if failure == "slow" else self.latency
+
+        words = self._reply(messages)
+        limit = len(words) if max_tokens is None else min(max_tokens, len(words))
+        finish_reason = "length" if limit < len(words) else "stop"
+        words = words[:limit]
+        response_id = f"fake-{next(self._ids)}"
+        prompt_tokens = sum(len(message["content"].split()) for message in messages)
+
+        request_timeout = kwargs.get("request_timeout")
+        if stream:
+            # As with the API, connect and first-read timeouts are raised by create() itself.
+            self._wait(latency, request_timeout)
+            return self._stream(response_id, model, words, finish_reason)
+
+        self._wait(latency + len(words) / self.tokens_per_second, request_timeout)
+        return {
+            "id": response_id,
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(words)},
+                "finish_reason": finish_reason,
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(words),
+                "total_tokens": prompt_tokens + len(words),
+            },
+        }
+
+    def _wait(self, seconds, request_timeout):
+        if request_timeout is not None and seconds > request_timeout:
+            time.sleep(request_timeout)
+            with self._lock:
+                self.timed_out += 1
+            raise openai.error.Timeout("Simulated read timeout")
+        time.sleep(seconds)
+
+    def _stream(self, response_id, model, words, finish_reason):
+        for position, word in enumerate(words):
+            time.sleep(1 / self.tokens_per_second)
+            try:
+                yield {
+                    "id": response_id,
+                    "object": "chat.completion.chunk",
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"content": word if position == 0 else " " + word},
+                        "finish_reason": None,
+                    }],
+                }
+            except GeneratorExit:
+                with self._lock:
+                    self.cancelled += 1
+                raise
+        yield {
+            "id": response_id,
+            "object": "chat.completion.chunk",
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}],
+        }
+
+
+def backend_from_env(name):
+    """Build the backend selected by the MODEL_BACKEND setting ("openai" or "fake")."""
+    if name == "fake":
+        return FakeBackend()
+    if name in ("", "openai"):
+        return OpenAIBackend()
+    raise ValueError(f"Unknown MODEL_BACKEND: {name}")
@@ -0,0 +1,230 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import telemetry
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from Constants import BATCH_WORKERS, BATCH_OUTPUT_DIR, CHECKPOINT_DIR, MAX_CONCURRENT_REQUESTS
+from client import get_usage, set_max_concurrent_requests
+from document_writer import render_document
+from main import STAGE_ORDER, STAGE_TITLES, build_case_stages
+from pipeline import run_stages
+
+
+class InvalidCaseError(ValueError):
+    """A line of a batch file that is not a usable case record."""
+
+
+def iter_cases(path):
+    """
+    Read case records from a JSONL file.
+
+    Args:
+        path (str): JSONL file with one case per line, using the keys accepted by
+                    build_case_stages plus an optional case_id.
+
+    Yields:
+        tuple: (line number, case) pairs, where case is the case record with case_id
+               defaulting to the line number, or an InvalidCaseError if the line is
+               not a JSON object.
+    """
+    with open(path, encoding="utf-8") as handle:
+        for line_number, line in enumerate(handle, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                case = json.loads(line)
+            except ValueError as e:
+                yield line_number, InvalidCaseError(f"line {line_number} is not valid JSON: {e}")
+                continue
+            if not isinstance(case, dict):
+                yield line_number, InvalidCaseError(f"line {line_number} is not a JSON object")
+                continue
+            case.setdefault("case_id", f"case-{line_number}")
+            yield line_number, case
+
+
+def _file_name(case_id):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", str(case_id))
+
+
+class Checkpoint:
+    """
+    Per-case record of finished stage outputs, so an interrupted batch can resume.
+
+    Outputs are only reused while the case inputs are unchanged, and failed stages
+    are never recorded so they run again on resume.
+
+    Args:
+        path (str): Location of the checkpoint JSON file.
+        case (dict): The case record the checkpoint belongs to.
+    """
+
+    def __init__(self, path, case):
+        self.path = path
+        self.inputs = hashlib.sha256(json.dumps(case, sort_keys=True).encode("utf-8")).hexdigest()
+        self.outputs = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as handle:
+                saved = json.load(handle)
+            if saved.get("inputs") == self.inputs:
+                self.outputs = saved.get("stages", {})
+
+    def record(self, stage, output):
+        if output.startswith("Error:"):
+            return
+        with self._lock:
+            self.outputs[stage] = output
+            temporary = self.path + ".tmp"
+            with open(temporary, "w", encoding="utf-8") as handle:
+                json.dump({"inputs": self.inputs, "stages": self.outputs}, handle)
+            os.replace(temporary, self.path)
+
+
+def process_case(case, output_dir=BATCH_OUTPUT_DIR, checkpoint_dir=CHECKPOINT_DIR):
+    """
+    Run every stage of one case, resuming from its checkpoint, and write its document.
+
+    Args:
+        case (dict): The case record.
+        output_dir (str): Directory for the generated .docx documents.
+        checkpoint_dir (str): Directory for the per-case checkpoints.
+
+    Returns:
+        dict: case_id, status ("done" or "failed"), path of the document, number of
+              resumed stages, failed stage names, continuation requests per stage that
+              needed any, and elapsed seconds.
+    """
+    started = time.monotonic()
+    name = _file_name(case["case_id"])
+    checkpoint = Checkpoint(os.path.join(checkpoint_dir, name + ".json"), case)
+    resumed = len(checkpoint.outputs)
+    document = os.path.join(output_dir, name + ".docx")
+
+    results = run_stages(build_case_stages(case), completed=checkpoint.outputs, on_complete=checkpoint.record)
+    failed = [stage for stage in STAGE_ORDER if results[stage].startswith("Error:")]
+    if not failed:
+        render_document(((STAGE_TITLES[stage], results[stage]) for stage in STAGE_ORDER), doc_filename=document)
+
+    return {
+        "case_id": case["case_id"],
+        "status": "failed" if failed else "done",
+        "document": None if failed else document,
+        "resumed_stages": resumed,
+        "failed_stages": failed,
+        "continuations": {stage: results[stage].continuations for stage in STAGE_ORDER
+                          if getattr(results[stage], "continuations", 0)},
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def run_batch(cases_path, output_dir=BATCH_OUTPUT_DIR, checkpoint_dir=CHECKPOINT_DIR, workers=BATCH_WORKERS):
+    """
+    Process every case of a JSONL file on a pool of workers.
+
+    Args:
+        cases_path (str): JSONL file with one case per line.
+        output_dir (str): Directory for the generated .docx documents.
+        checkpoint_dir (str): Directory for the per-case checkpoints.
+        workers (int): Number of cases processed at the same time.
+
+    Returns:
+        dict: Summary of the run with per-case results, throughput, failures and tokens used.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    usage_before = get_usage()
+    started = time.monotonic()
+
+    cases = []
+
+    def rejected(case_id, line_number, error):
+        outcome = {"case_id": case_id, "status": "failed", "line": line_number, "error": error}
+        print(f"{case_id}: failed ({error})")
+        cases.append(outcome)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        # Cases sharing a file name would write the same checkpoint and document at the same time.
+        lines_by_name = {}
+        for line_number, case in iter_cases(cases_path):
+            if isinstance(case, InvalidCaseError):
+                rejected(f"case-{line_number}", line_number, str(case))
+                continue
+            name = _file_name(case["case_id"])
+            if name in lines_by_name:
+                rejected(case["case_id"], line_number,
+                         f"case_id {case['case_id']!r} is already used on line {lines_by_name[name]}")
+                continue
+            lines_by_name[name] = line_number
+            futures[executor.submit(process_case, case, output_dir, checkpoint_dir)] = case["case_id"]
+        for future in as_completed(futures):
+            try:
+                outcome = future.result()
+            except Exception as e:
+                outcome = {"case_id": futures[future], "status": "failed", "error": str(e)}
+            print(f"{outcome['case_id']}: {outcome['status']}")
+            cases.append(outcome)
+
+    elapsed = time.monotonic() - started
+    usage_after = get_usage()
+    done = sum(1 for outcome in cases if outcome["status"] == "done")
+    return {
+        "cases": len(cases),
+        "done": done,
+        "failed": len(cases) - done,
+        "seconds": round(elapsed, 3),
+        "cases_per_hour": round(done / elapsed * 3600, 2) if elapsed else 0.0,
+        "requests": usage_after["requests"] - usage_before["requests"],
+        "coalesced_requests": usage_after["coalesced"] - usage_before["coalesced"],
+        "continuations": usage_after["continuations"] - usage_before["continuations"],
+        "prompt_tokens": usage_after["prompt_tokens"] - usage_before["prompt_tokens"],
+        "completion_tokens": usage_after["completion_tokens"] - usage_before["completion_tokens"],
+        "results": sorted(cases, key=lambda outcome: str(outcome["case_id"])),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate case analysis documents for many cases from a JSONL file.")
+    parser.add_argument("cases", help="JSONL file with one case record per line")
+    parser.add_argument("--output-dir", default=BATCH_OUTPUT_DIR, help="directory for the .docx documents")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR, help="directory for per-case checkpoints")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="cases processed at the same time")
+    parser.add_argument("--max-requests", type=int, default=MAX_CONCURRENT_REQUESTS,
+                        help="model requests in flight at the same time across all cases")
+    parser.add_argument("--summary", help="also write the run summary to this JSON file")
+    parser.add_argument("--report", help="record telemetry and write the JSON run report to this file")
+    parser.add_argument("--metrics", help="record telemetry and write Prometheus metrics to this file")
+    args = parser.parse_args(argv)
+
+    set_max_concurrent_requests(args.max_requests)
+    if args.report or args.metrics:
+        telemetry.enable()
+    summary = run_batch(args.cases, args.output_dir, args.checkpoint_dir, args.workers)
+
+    print(
+        f"Processed {summary['cases']} cases in {summary['seconds']}s: {summary['done']} done, "
+        f"{summary['failed']} failed, {summary['cases_per_hour']} cases/hour, "
+        f"{summary['requests']} requests ({summary['coalesced_requests']} shared, "
+        f"{summary['continuations']} continuations), "
+        f"{summary['prompt_tokens']} prompt tokens, "
+        f"{summary['completion_tokens']} completion tokens."
+    )
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as handle:
+            json.dump(summary, handle, indent=2)
+    if args.report:
+        telemetry.write_json_report(args.report)
+    if args.metrics:
+        telemetry.write_prometheus(args.metrics)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Cost of truncated responses: continuing them versus rerunning the stage with a larger budget.
+
+The FakeBackend writes replies longer than the max_tokens of the request, as the
+3000-4000 word stage prompts do. Three strategies are compared on the same workload:
+keeping the truncated text, rerunning truncated requests with room for the whole
+reply, and continuing them with the tail of the text (create_chat_completion).
+Completion tokens generated, latency and how much of each reply arrives are reported.
+
+    python benchmarks/bench_continuation.py --requests 40 --completion-tokens 3000 --max-tokens 1200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ["RESPONSE_CACHE"] = "off"
+
+import client  # noqa: E402
+from backends import FakeBackend  # noqa: E402
+from bench_pipeline import summarize  # noqa: E402
+from scheduler import RequestScheduler  # noqa: E402
+
+
+def run(args, strategy):
+    backend = FakeBackend(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                          completion_tokens=args.completion_tokens, seed=args.seed)
+    client.set_backend(backend)
+    client.set_scheduler(RequestScheduler(tokens_per_minute=1e9))
+    full = " ".join(backend.reply_tokens(args.completion_tokens))
+    usage_before = client.get_usage()
+
+    def one(index):
+        messages = [{"role": "user", "content": f"{strategy} request {index}"}]
+        started = time.perf_counter()
+        continuations = 0 if strategy != "continue" else args.max_continuations
+        response = client.create_chat_completion("gpt-4o", messages, 0.7, args.max_tokens,
+                                                 max_continuations=continuations)
+        if strategy == "rerun" and response['choices'][0]['finish_reason'] == "length":
+            response = client.create_chat_completion("gpt-4o", messages, 0.7, args.completion_tokens + 100,
+                                                     max_continuations=0)
+        text = response['choices'][0]['message']['content']
+        return time.perf_counter() - started, len(text) / len(full), text == full
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        outcomes = list(executor.map(one, range(args.requests)))
+    usage_after = client.get_usage()
+    return {
+        "latency_seconds": summarize([seconds for seconds, _, _ in outcomes]),
+        "complete_replies": sum(1 for _, _, complete in outcomes if complete),
+        "text_delivered": round(sum(fraction for _, fraction, _ in outcomes) / len(outcomes), 4),
+        "requests": usage_after["requests"] - usage_before["requests"],
+        "continuations": usage_after["continuations"] - usage_before["continuations"],
+        "completion_tokens": usage_after["completion_tokens"] - usage_before["completion_tokens"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=20000.0)
+    parser.add_argument("--completion-tokens", type=int, default=3000, help="length of a full reply")
+    parser.add_argument("--max-tokens", type=int, default=1200, help="completion limit of each request")
+    parser.add_argument("--max-continuations", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    report = {strategy: run(args, strategy) for strategy in ("truncate", "rerun", "continue")}
+    print(f"{'':<9} {'p50':>7} {'p95':>7} {'complete':>9} {'delivered':>10} {'requests':>9} "
+          f"{'continued':>10} {'completion tokens':>18}")
+    for name, result in report.items():
+        stats = result["latency_seconds"]
+        print(f"{name:<9} {stats['p50']:>7.3f} {stats['p95']:>7.3f} {result['complete_replies']:>9} "
+              f"{result['text_delivered']:>10.1%} {result['requests']:>9} {result['continuations']:>10} "
+              f"{result['completion_tokens']:>18}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Tail latency of model requests with and without hedging, against a latency-injecting FakeBackend.
+
+A fraction of requests stall before their first token, like the occasional request
+that hangs for minutes in production. The same workload runs twice, once plainly
+and once inside hedge_requests, and the p50/p95/p99 latency, hedges sent and
+cancelled duplicates are compared.
+
+    python benchmarks/bench_hedging.py --requests 200 --slow-rate 0.05 --slow-latency 5 --first-token 1
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ["RESPONSE_CACHE"] = "off"
+
+import client  # noqa: E402
+from backends import FakeBackend  # noqa: E402
+from bench_pipeline import summarize  # noqa: E402
+from hedging import HedgeBudget, HedgePolicy, hedge_requests  # noqa: E402
+from scheduler import RequestScheduler  # noqa: E402
+
+
+def run(args, policy, label):
+    backend = FakeBackend(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                          completion_tokens=args.completion_tokens, slow_rate=args.slow_rate,
+                          slow_latency=args.slow_latency, seed=args.seed)
+    budget = HedgeBudget(args.max_fraction)
+    client.set_backend(backend)
+    client.set_hedge_budget(budget)
+    client.set_scheduler(RequestScheduler(tokens_per_minute=1e9))
+
+    def one(index):
+        messages = [{"role": "user", "content": f"{label} request {index}"}]
+        started = time.perf_counter()
+        with hedge_requests(policy):
+            client.create_chat_completion("gpt-4o", messages, 0.7, 2000)
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = list(executor.map(one, range(args.requests)))
+    # Give cancelled duplicates a moment to notice and close their streams.
+    time.sleep(args.slow_latency + 0.5 if policy else 0)
+    return {
+        "latency_seconds": summarize(latencies),
+        "backend_calls": backend.calls,
+        "slow_requests": backend.slow,
+        "hedges": budget.hedges,
+        "cancelled_streams": backend.cancelled,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.2, help="normal seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0)
+    parser.add_argument("--completion-tokens", type=int, default=400)
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="fraction of requests that stall")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="seconds a stalled request waits")
+    parser.add_argument("--first-token", type=float, default=1.0, help="hedge after this many seconds without text")
+    parser.add_argument("--stall", type=float, default=1.0, help="hedge after this many seconds without progress")
+    parser.add_argument("--max-fraction", type=float, default=0.1, help="cap on hedges as a share of requests")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    report = {
+        "plain": run(args, None, "plain"),
+        "hedged": run(args, HedgePolicy(first_token_seconds=args.first_token, stall_seconds=args.stall), "hedged"),
+    }
+    print(f"{'':<8} {'p50':>8} {'p95':>8} {'p99':>8} {'calls':>6} {'slow':>5} {'hedges':>7} {'cancelled':>10}")
+    for name, result in report.items():
+        stats = result["latency_seconds"]
+        print(f"{name:<8} {stats['p50']:>8.3f} {stats['p95']:>8.3f} {stats['p99']:>8.3f} {result['backend_calls']:>6} "
+              f"{result['slow_requests']:>5} {result['hedges']:>7} {result['cancelled_streams']:>10}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+End-to-end pipeline benchmark against the in-process FakeBackend; no API key or spend needed.
+
+Reports per-stage and end-to-end latency (p50/p95/p99), time to first output in
+streaming mode, document render time, and cases per hour for a batch run. The
+--max-* and --min-* options turn it into a CI gate: the exit status is 1 when a
+threshold is missed.
+
+    python benchmarks/bench_pipeline.py --cases 5 --batch 20 --latency 0.05 --tokens-per-second 2000
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["RESPONSE_CACHE"] = "off"
+
+import client  # noqa: E402
+from backends import FakeBackend  # noqa: E402
+from batch import run_batch  # noqa: E402
+from document_writer import render_document  # noqa: E402
+from knowledge import KnowledgeStore, set_knowledge_store  # noqa: E402
+from main import STAGE_ORDER, STAGE_TITLES, build_case_stages  # noqa: E402
+from pipeline import run_stages, stream_stages  # noqa: E402
+from scheduler import RequestScheduler  # noqa: E402
+
+SAMPLE_CASE = {
+    "transcript": "Page 1\n 1 Q. Did the student make progress in speech therapy?\n 2 A. Not meaningful progress.",
+    "specific_issues": "Highlight testimony related to student assessments and procedural compliance.",
+    "case_description": "A 10-year-old student with autism was denied necessary speech therapy services.",
+    "case_description1": "The hearing officer ignored independent evaluations and excluded parent evidence.",
+    "case_issues": "The IEP was found to meet FAPE despite evidence of no meaningful progress.",
+    "case_violations": "The district failed to address speech therapy needs and delayed evaluations.",
+    "case_details": "The decision failed to address procedural violations under IDEA.",
+    "counterarguments": "The district may argue the IEP was reasonably calculated to provide benefit.",
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        "p50": round(percentile(values, 0.50), 4),
+        "p95": round(percentile(values, 0.95), 4),
+        "p99": round(percentile(values, 0.99), 4),
+        "n": len(values),
+    }
+
+
+def _timed(func, samples):
+    def run(*args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            samples.append(time.perf_counter() - started)
+    return run
+
+
+def run_single_cases(count, directory):
+    stage_samples = {name: [] for name in STAGE_ORDER}
+    end_to_end = []
+    render = []
+    for index in range(count):
+        case = dict(SAMPLE_CASE, case_description=f"{SAMPLE_CASE['case_description']} Case {index}.")
+        stages = build_case_stages(case)
+        for stage in stages:
+            stage.func = _timed(stage.func, stage_samples[stage.name])
+
+        started = time.perf_counter()
+        results = run_stages(stages)
+        rendered = time.perf_counter()
+        render_document(((STAGE_TITLES[name], results[name]) for name in STAGE_ORDER),
+                        doc_filename=os.path.join(directory, f"single-{index}.docx"))
+        finished = time.perf_counter()
+        end_to_end.append(finished - started)
+        render.append(finished - rendered)
+    return stage_samples, end_to_end, render
+
+
+def run_streaming_cases(count, directory):
+    first_output = []
+    for index in range(count):
+        case = dict(SAMPLE_CASE, case_description=f"{SAMPLE_CASE['case_description']} Streamed case {index}.")
+        started = time.perf_counter()
+        pieces = stream_stages(build_case_stages(case, stream=True))
+        next(pieces)
+        first_output.append(time.perf_counter() - started)
+        for _ in pieces:
+            pass
+    return first_output
+
+
+def run_batch_cases(count, workers, directory):
+    cases_path = os.path.join(directory, "cases.jsonl")
+    with open(cases_path, "w", encoding="utf-8") as handle:
+        for index in range(count):
+            handle.write(json.dumps(dict(SAMPLE_CASE, case_id=f"bench-{index}")) + "\n")
+    return run_batch(cases_path, os.path.join(directory, "output"), os.path.join(directory, "checkpoints"), workers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, default=5, help="single-case runs")
+    parser.add_argument("--batch", type=int, default=20, help="cases in the batch run; 0 to skip")
+    parser.add_argument("--workers", type=int, default=4, help="batch workers")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0)
+    parser.add_argument("--completion-tokens", type=int, default=400)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="fraction of requests that time out")
+    parser.add_argument("--tokens-per-minute", type=float, default=1e9, help="scheduler token budget")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--max-p95-case-seconds", type=float, help="fail if end-to-end p95 exceeds this")
+    parser.add_argument("--max-p95-render-seconds", type=float, help="fail if render p95 exceeds this")
+    parser.add_argument("--min-cases-per-hour", type=float, help="fail if batch throughput is below this")
+    args = parser.parse_args(argv)
+
+    backend = FakeBackend(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                          completion_tokens=args.completion_tokens, rate_limit_rate=args.rate_limit_rate,
+                          timeout_rate=args.timeout_rate, timeout_after=args.latency * 4, seed=args.seed)
+    client.set_backend(backend)
+    client.set_scheduler(RequestScheduler(tokens_per_minute=args.tokens_per_minute, base_delay=0.05, max_delay=1.0))
+
+    with tempfile.TemporaryDirectory() as directory:
+        set_knowledge_store(KnowledgeStore(os.path.join(directory, "knowledge")))
+        stage_samples, end_to_end, render = run_single_cases(args.cases, directory)
+        first_output = run_streaming_cases(args.cases, directory)
+        batch = run_batch_cases(args.batch, args.workers, directory) if args.batch else None
+
+    report = {
+        "stages": {name: summarize(samples) for name, samples in stage_samples.items()},
+        "case_seconds": summarize(end_to_end),
+        "render_seconds": summarize(render),
+        "stream_first_output_seconds": summarize(first_output),
+        "batch": None if batch is None else {
+            key: batch[key] for key in ("cases", "done", "failed", "seconds", "cases_per_hour", "requests")
+        },
+        "backend": {"calls": backend.calls, "rate_limited": backend.rate_limited, "timed_out": backend.timed_out},
+    }
+
+    print(f"{'stage':<20} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, stats in list(report["stages"].items()) + [
+        ("end to end", report["case_seconds"]),
+        ("render", report["render_seconds"]),
+        ("stream first output", report["stream_first_output_seconds"]),
+    ]:
+        print(f"{name:<20} {stats['p50']:>8.3f} {stats['p95']:>8.3f} {stats['p99']:>8.3f}")
+    if report["batch"]:
+        print(f"batch: {report['batch']['done']}/{report['batch']['cases']} cases in {report['batch']['seconds']}s, "
+              f"{report['batch']['cases_per_hour']} cases/hour")
+    print(f"backend: {report['backend']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+
+    failures = []
+    if args.max_p95_case_seconds is not None and report["case_seconds"]["p95"] > args.max_p95_case_seconds:
+        failures.append(f"end-to-end p95 {report['case_seconds']['p95']}s > {args.max_p95_case_seconds}s")
+    if args.max_p95_render_seconds is not None and report["render_seconds"]["p95"] > args.max_p95_render_seconds:
+        failures.append(f"render p95 {report['render_seconds']['p95']}s > {args.max_p95_render_seconds}s")
+    if args.min_cases_per_hour is not None and batch and batch["cases_per_hour"] < args.min_cases_per_hour:
+        failures.append(f"batch {batch['cases_per_hour']} cases/hour < {args.min_cases_per_hour}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Benchmark document rendering: time and peak RSS for 50-70 page documents, and
+throughput for a batch of documents rendered in a process pool.
+
+    python benchmarks/bench_render.py --pages 50 70 --batch 24 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document_writer import render_document  # noqa: E402
+
+WORDS_PER_PAGE = 300
+SECTIONS = 7
+SENTENCE = "The hearing officer failed to weigh the independent evaluation of the student's progress"
+
+
+def synthetic_section(words):
+    """
+    Yield Markdown text shaped like a stage output, in pieces, totalling about `words` words.
+
+    Like model output, most of the text is in short numbered lists, each followed by a
+    paragraph, with indented explanations and bullets under the items.
+    """
+    written = 0
+    heading = 0
+    while written < words:
+        heading += 1
+        yield f"## {heading}. Issue {heading}\n\n"
+        yield f"**Summary:** {SENTENCE} and the district's timelines.\n\n"
+        written += 19
+        for _ in range(4):
+            for item in range(1, 4):
+                yield f"{item}. **Finding {item}:** {SENTENCE}.\n"
+                yield f"   {SENTENCE} under IDEA.\n"
+                yield f"   - Testimony at {heading}:{item} was undervalued.\n"
+            yield " ".join([SENTENCE] * 2) + ".\n\n"
+            written += 3 * 35 + 28
+
+
+def synthetic_sections(pages):
+    words = pages * WORDS_PER_PAGE // SECTIONS
+    for number in range(SECTIONS):
+        yield f"Section {number + 1}", synthetic_section(words)
+
+
+def render(pages, doc_filename):
+    started = time.perf_counter()
+    writer = render_document(synthetic_sections(pages), doc_filename=doc_filename)
+    return time.perf_counter() - started, writer.words
+
+
+def _measure_single(pages, doc_filename):
+    seconds, words = render(pages, doc_filename)
+    # ru_maxrss is reported in kilobytes on Linux.
+    return seconds, words, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _render_one(args):
+    pages, doc_filename = args
+    return render(pages, doc_filename)[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[50, 60, 70])
+    parser.add_argument("--batch", type=int, default=24, help="documents rendered in the batch run")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'pages':>6} {'words':>8} {'seconds':>8} {'peak RSS MB':>12}")
+        for pages in args.pages:
+            # A fresh process per size, so peak RSS is not inherited from earlier runs.
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                seconds, words, rss = executor.submit(
+                    _measure_single, pages, os.path.join(directory, f"single-{pages}.docx")
+                ).result()
+            print(f"{pages:>6} {words:>8} {seconds:>8.3f} {rss:>12.1f}")
+
+        jobs = [
+            (args.pages[index % len(args.pages)], os.path.join(directory, f"batch-{index}.docx"))
+            for index in range(args.batch)
+        ]
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as executor:
+            per_document = list(executor.map(_render_one, jobs))
+        elapsed = time.perf_counter() - started
+        print(
+            f"batch: {args.batch} documents on {args.workers} workers in {elapsed:.2f}s "
+            f"({args.batch / elapsed:.2f} documents/s, mean {sum(per_document) / len(per_document):.3f}s per document)"
+        )
+
+
+if __name__ == "__main__":
+    main()
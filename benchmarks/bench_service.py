@@ -0,0 +1,141 @@
+"""
+Per-case process startup versus a warm service, against the local stand-in endpoint.
+
+Measures the cost of importing the pipeline in a fresh interpreter, the wall time of
+one case run as its own `python batch.py` process, and the per-job time of the same
+case submitted to an already-running service. The stand-in answers instantly by
+default, so the numbers are the pipeline's own overhead rather than model latency.
+The stand-in also counts client connections, which shows keep-alive reuse.
+
+    python benchmarks/bench_service.py --jobs 20
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_pipeline import SAMPLE_CASE, summarize  # noqa: E402
+import standin_server  # noqa: E402
+
+
+def _environment(api_base):
+    return dict(os.environ, OPENAI_API_BASE=api_base, OPENAI_API_KEY="test", MODEL_BACKEND="openai",
+                RESPONSE_CACHE="off", TELEMETRY="off")
+
+
+def measure_import(runs, environment):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import main"], cwd=ROOT, env=environment, check=True)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def measure_process_per_case(runs, environment, directory):
+    samples = []
+    for index in range(runs):
+        cases_path = os.path.join(directory, f"cold-{index}.jsonl")
+        with open(cases_path, "w", encoding="utf-8") as handle:
+            handle.write(json.dumps(dict(SAMPLE_CASE, case_id=f"cold-{index}")) + "\n")
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "batch.py", cases_path, "--output-dir", os.path.join(directory, "cold"),
+                        "--checkpoint-dir", os.path.join(directory, "cold-checkpoints")],
+                       cwd=ROOT, env=environment, check=True, stdout=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def measure_service(jobs, directory):
+    import client
+    import service
+    from scheduler import RequestScheduler
+
+    # Keep the token budget out of the measurement; it is the same in both modes.
+    client.set_scheduler(RequestScheduler(tokens_per_minute=1e9))
+    case_service = service.CaseService(workers=1, output_dir=os.path.join(directory, "warm"),
+                                       checkpoint_dir=os.path.join(directory, "warm-checkpoints"))
+    server = service.serve(case_service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+    samples = []
+    statuses = []
+    try:
+        for index in range(jobs):
+            body = json.dumps(dict(SAMPLE_CASE, case_id=f"warm-{index}"))
+            started = time.perf_counter()
+            connection.request("POST", "/jobs?wait=1", body, {"Content-Type": "application/json"})
+            job = json.loads(connection.getresponse().read())
+            samples.append(time.perf_counter() - started)
+            statuses.append(job["status"])
+    finally:
+        connection.close()
+        server.shutdown()
+        server.server_close()
+        case_service.shutdown()
+    return samples, statuses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=20, help="jobs submitted to the warm service")
+    parser.add_argument("--cold-runs", type=int, default=3, help="fresh-process runs")
+    parser.add_argument("--latency", type=float, default=0.0, help="stand-in seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=1e9)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    standin = standin_server.start(latency=args.latency, tokens_per_second=args.tokens_per_second)
+    api_base = f"http://127.0.0.1:{standin.server_address[1]}/v1"
+    environment = _environment(api_base)
+    os.environ.update(environment)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Blocks generated by the stand-in are kept out of the real knowledge store.
+        environment["KNOWLEDGE_DIR"] = os.environ["KNOWLEDGE_DIR"] = os.path.join(directory, "knowledge")
+        imports = measure_import(args.cold_runs, environment)
+        cold = measure_process_per_case(args.cold_runs, environment, directory)
+        cold_requests, cold_connections = standin.requests, standin.connections
+        warm, statuses = measure_service(args.jobs, directory)
+
+    report = {
+        "import_seconds": summarize(imports),
+        "process_per_case_seconds": summarize(cold),
+        "service_job_seconds": summarize(warm),
+        "service_jobs_done": statuses.count("done"),
+        "startup_overhead_seconds": round(summarize(cold)["p50"] - summarize(warm)["p50"], 4),
+        "process_per_case_connections": {"requests": cold_requests, "connections": cold_connections},
+        "service_connections": {
+            "requests": standin.requests - cold_requests,
+            "connections": standin.connections - cold_connections,
+        },
+    }
+
+    print(f"{'':<24} {'p50':>8} {'p95':>8}")
+    for name, key in (("import main", "import_seconds"), ("process per case", "process_per_case_seconds"),
+                      ("warm service job", "service_job_seconds")):
+        print(f"{name:<24} {report[key]['p50']:>8.3f} {report[key]['p95']:>8.3f}")
+    print(f"warm service: {report['service_jobs_done']}/{args.jobs} jobs done")
+    print(f"startup overhead per case: {report['startup_overhead_seconds']}s")
+    print(f"connections, process per case: {report['process_per_case_connections']}")
+    print(f"connections, warm service:     {report['service_connections']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+    standin.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
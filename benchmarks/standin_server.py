@@ -0,0 +1,129 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint, backed by FakeBackend.
+
+Point the pipeline at it with OPENAI_API_BASE=http://127.0.0.1:<port>/v1 to test the
+real HTTP path (pooled connections, streaming, retries) without an API key:
+
+    python benchmarks/standin_server.py --port 8081 --latency 0.5 --rate-limit-rate 0.05 --slow-rate 0.02
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openai  # noqa: E402
+from backends import FakeBackend  # noqa: E402
+
+
+class StandinServer(ThreadingHTTPServer):
+    """HTTP server answering POST /v1/chat/completions from a FakeBackend and counting connections."""
+
+    daemon_threads = True
+
+    def __init__(self, address, backend):
+        self.backend = backend
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        super().__init__(address, _StandinHandler)
+
+    def count(self, attribute):
+        with self._lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+
+
+class _StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.count("connections")
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        self.server.count("requests")
+        params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            return
+        try:
+            result = self.server.backend.create(**params)
+        except openai.error.RateLimitError as e:
+            self._send_json(429, {"error": {"message": str(e), "type": "rate_limit_error"}}, e.headers)
+            return
+        except openai.error.Timeout as e:
+            self._send_json(504, {"error": {"message": str(e), "type": "timeout"}})
+            return
+
+        if not params.get("stream"):
+            self._send_json(200, result)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in result:
+            self._write_chunk(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start(port=0, **backend_options):
+    """
+    Start a stand-in server on a background thread.
+
+    Returns:
+        StandinServer: The running server; its base URL is http://127.0.0.1:<server_address[1]>/v1.
+    """
+    server = StandinServer(("127.0.0.1", port), FakeBackend(**backend_options))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0)
+    parser.add_argument("--completion-tokens", type=int, default=400)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests that stall")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="seconds a stalled request waits")
+    args = parser.parse_args(argv)
+
+    server = StandinServer(("127.0.0.1", args.port), FakeBackend(
+        latency=args.latency, tokens_per_second=args.tokens_per_second, completion_tokens=args.completion_tokens,
+        rate_limit_rate=args.rate_limit_rate, timeout_rate=args.timeout_rate, slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+    ))
+    print(f"Stand-in endpoint on http://127.0.0.1:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
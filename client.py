@@ -0,0 +1,437 @@
+import os
+import threading
+import telemetry
+from backends import backend_from_env
+from cache import ResponseCache
+from Constants import MAX_CONCURRENT_REQUESTS, MAX_CONTINUATIONS
+from continuation import CompletionText, continuation_messages, stitch, stitch_stream
+from hedging import HedgeBudget, HedgedRequest, current_hedge_policy
+from scheduler import RequestScheduler, current_priority, estimate_tokens
+from singleflight import SingleFlight
+from tokens import ContextWindowExceededError, budget_max_tokens, count_tokens
+
+_cache = None
+_scheduler = None
+_backend = None
+_cache_lock = threading.Lock()
+_in_flight = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+_usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "continuations": 0}
+_usage_lock = threading.Lock()
+_single_flight = SingleFlight()
+_hedge_budget = HedgeBudget()
+
+
+def cache_enabled():
+    """Return False when the response cache is switched off with RESPONSE_CACHE=off."""
+    return os.getenv("RESPONSE_CACHE", "on").lower() not in ("off", "0", "false", "no")
+
+
+def get_cache():
+    """Return the process-wide response cache, opening it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+
+def get_scheduler():
+    """Return the process-wide request scheduler shared by all stages."""
+    global _scheduler
+    with _cache_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
+
+
+def get_backend():
+    """Return the model backend, chosen by MODEL_BACKEND ("openai" by default, or "fake")."""
+    global _backend
+    with _cache_lock:
+        if _backend is None:
+            _backend = backend_from_env(os.getenv("MODEL_BACKEND", "openai").lower())
+        return _backend
+
+
+def set_backend(backend):
+    """Send all model requests to the given backend, e.g. a FakeBackend in tests and benchmarks."""
+    global _backend
+    with _cache_lock:
+        _backend = backend
+
+
+def set_scheduler(scheduler):
+    """Replace the shared request scheduler, e.g. to use different rate limits."""
+    global _scheduler
+    with _cache_lock:
+        _scheduler = scheduler
+
+
+def set_hedge_budget(budget):
+    """Replace the shared HedgeBudget, e.g. to change the cap on hedged requests."""
+    global _hedge_budget
+    _hedge_budget = budget
+
+
+def set_max_concurrent_requests(limit):
+    """Change the global cap on model requests in flight at the same time."""
+    global _in_flight
+    _in_flight = threading.BoundedSemaphore(limit)
+
+
+def get_usage():
+    """
+    Report the API usage of this process; cache hits are not counted.
+
+    Returns:
+        dict: Number of requests, prompt and completion tokens, the number of
+              continuations of responses cut off by the length limit, the
+              number of requests saved by sharing an identical request
+              already in flight, and the number of hedged duplicates sent.
+    """
+    with _usage_lock:
+        usage = dict(_usage)
+    usage["coalesced"] = _single_flight.coalesced
+    usage["hedges"] = _hedge_budget.hedges
+    return usage
+
+
+def _record_usage(prompt_tokens, completion_tokens):
+    with _usage_lock:
+        _usage["requests"] += 1
+        _usage["prompt_tokens"] += prompt_tokens
+        _usage["completion_tokens"] += completion_tokens
+
+
+def _count_continuation(span):
+    span.set("continuations", 1)
+    with _usage_lock:
+        _usage["continuations"] += 1
+
+
+def create_chat_completion(model, messages, temperature, max_tokens, use_cache=True,
+                           max_continuations=MAX_CONTINUATIONS):
+    """
+    Send a ChatCompletion request, serving byte-identical requests from the response cache.
+
+    An identical request already in flight, e.g. from another case with the same
+    description, is shared instead of sent again. Requests that reach the API go
+    through the shared RequestScheduler, which enforces the rate limit budget and
+    retries transient failures. Inside hedge_requests(policy), a request that is
+    slow to respond is raced against a duplicate.
+
+    A response cut off by the length limit (finish_reason "length") is continued with
+    up to max_continuations further requests, each sent only the tail of the text so
+    far, and the pieces are joined into one response.
+
+    Args:
+        model (str): Model name.
+        messages (list): Chat messages to send.
+        temperature (float): Sampling temperature.
+        max_tokens (int): Completion token limit per request; lowered to what fits in the
+                          model's context window.
+        use_cache (bool): Set to False to always call the API, e.g. for non-deterministic runs;
+                          this also stops identical requests from being shared.
+        max_continuations (int): Cap on continuation requests; 0 returns truncated responses as they are.
+
+    Returns:
+        dict: The ChatCompletion response. Its content is a CompletionText, whose
+              continuations attribute counts the continuation requests.
+
+    Raises:
+        ContextWindowExceededError: If the prompt leaves no room for a useful response.
+    """
+    response = _create_once(model, messages, temperature, max_tokens, use_cache)
+    choice = response['choices'][0]
+    text = choice['message']['content'] or ""
+    finish_reason = choice.get('finish_reason')
+    continuations = 0
+    while finish_reason == "length" and continuations < max_continuations:
+        try:
+            more = _create_once(model, continuation_messages(messages, text), temperature, max_tokens,
+                                use_cache, continuation=True)
+        except ContextWindowExceededError:
+            break
+        continuations += 1
+        text = stitch(text, more['choices'][0]['message']['content'] or "")
+        finish_reason = more['choices'][0].get('finish_reason')
+
+    # Cached and shared responses are never modified, so a new one is built.
+    content = CompletionText(text, continuations, finish_reason == "length")
+    return dict(response, choices=[dict(choice, message=dict(choice['message'], content=content),
+                                        finish_reason=finish_reason)])
+
+
+def _create_once(model, messages, temperature, max_tokens, use_cache, continuation=False):
+    max_tokens = budget_max_tokens(model, messages, max_tokens)
+    key = ResponseCache.make_key(model, messages, temperature, max_tokens)
+    with telemetry.span("model_call", model=model, max_tokens=max_tokens) as span:
+        if continuation:
+            _count_continuation(span)
+        cache = get_cache() if use_cache and cache_enabled() else None
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                span.set("cache", "hit")
+                return cached
+        span.set("cache", "miss" if cache is not None else "off")
+
+        def send():
+            _hedge_budget.count_request()
+            policy = current_hedge_policy()
+            if policy is not None:
+                request = _hedged_request(model, messages, temperature, max_tokens, policy, span)
+                text = request.collect()
+                response = {
+                    "model": request.model,
+                    "choices": [{
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": request.finish_reason,
+                    }],
+                    "usage": _record_attempts(request, messages, span),
+                }
+                # A reply from the fallback model is not stored under the requested model.
+                if cache is not None and request.model == model:
+                    cache.set(key, response)
+                return response
+
+            scheduler = get_scheduler()
+            tokens = estimate_tokens(messages, max_tokens, model)
+            with _in_flight:
+                response = scheduler.call(lambda: get_backend().create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                ), tokens, span=span)
+            usage = response.get('usage') or {}
+            scheduler.settle(tokens, usage.get('total_tokens'))
+            _record_usage(usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
+            _record_span_usage(span, model, usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
+
+            if cache is not None:
+                cache.set(key, response)
+            return response
+
+        if not use_cache:
+            return send()
+        response, shared = _single_flight.do(key, send)
+        if shared:
+            span.set("cache", "coalesced")
+        return response
+
+
+def _hedged_request(model, messages, temperature, max_tokens, policy, span):
+    priority = current_priority()
+
+    def open_stream(attempt_model, sent, cancelled):
+        attempt_max_tokens = max_tokens
+        if attempt_model != model:
+            attempt_max_tokens = budget_max_tokens(attempt_model, messages, max_tokens)
+
+        def send():
+            sent()
+            return get_backend().create(
+                model=attempt_model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=attempt_max_tokens,
+                stream=True,
+                request_timeout=policy.request_timeout
+            )
+
+        scheduler = get_scheduler()
+        tokens = estimate_tokens(messages, attempt_max_tokens, attempt_model)
+        with _in_flight:
+            chunks = scheduler.call(send, tokens, priority=priority, span=span, cancelled=cancelled)
+            parts = []
+            try:
+                for chunk in chunks:
+                    content = chunk['choices'][0]['delta'].get('content')
+                    if content:
+                        parts.append(content)
+                    yield chunk
+            finally:
+                # Settled with what was generated, also when the attempt is cancelled or fails midway.
+                scheduler.settle(tokens, estimate_tokens(messages, 0, attempt_model)
+                                 + count_tokens("".join(parts), attempt_model))
+
+    return HedgedRequest(open_stream, model, policy, _hedge_budget, span)
+
+
+def _record_attempts(request, messages, span):
+    # Every attempt is billed, including a cancelled one up to where it stopped.
+    prompt_total = completion_total = 0
+    winner_usage = None
+    for index, attempt in enumerate(request.attempts):
+        if attempt is None:
+            continue
+        prompt_tokens = estimate_tokens(messages, 0, attempt.model)
+        completion_tokens = count_tokens("".join(attempt.parts), attempt.model)
+        _record_usage(prompt_tokens, completion_tokens)
+        prompt_total += prompt_tokens
+        completion_total += completion_tokens
+        if index == request.winner:
+            winner_usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                            "total_tokens": prompt_tokens + completion_tokens}
+    _record_span_usage(span, request.model, prompt_total, completion_total)
+    return winner_usage
+
+
+def _record_span_usage(span, model, prompt_tokens, completion_tokens):
+    if not telemetry.is_enabled():
+        return
+    span.set("prompt_tokens", prompt_tokens)
+    span.set("completion_tokens", completion_tokens)
+    span.set("cost_usd", telemetry.estimate_cost(model, prompt_tokens, completion_tokens))
+
+
+def _collect(pieces, parts):
+    # Like "yield from pieces", also keeping the pieces in parts.
+    try:
+        while True:
+            try:
+                piece = next(pieces)
+            except StopIteration as stop:
+                return stop.value
+            parts.append(piece)
+            yield piece
+    finally:
+        pieces.close()
+
+
+def stream_chat_completion(model, messages, temperature, max_tokens, use_cache=True,
+                           max_continuations=MAX_CONTINUATIONS):
+    """
+    Stream a ChatCompletion response as it is generated.
+
+    Cached responses are yielded in one piece; fresh responses are stored in the
+    cache once the stream has finished. A caller streaming a request identical to
+    one already in flight receives the pieces of that stream instead of opening its own.
+    A response cut off by the length limit is continued as in create_chat_completion,
+    so the continuation follows on in the same stream.
+
+    Args:
+        model (str): Model name.
+        messages (list): Chat messages to send.
+        temperature (float): Sampling temperature.
+        max_tokens (int): Completion token limit per request; lowered to what fits in the
+                          model's context window.
+        use_cache (bool): Set to False to always call the API.
+        max_continuations (int): Cap on continuation requests; 0 stops at the first response.
+
+    Yields:
+        str: Pieces of the generated text.
+
+    Raises:
+        ContextWindowExceededError: If the prompt leaves no room for a useful response.
+    """
+    parts = []
+    finish_reason = yield from _collect(_stream_once(model, messages, temperature, max_tokens, use_cache), parts)
+    continuations = 0
+    while finish_reason == "length" and continuations < max_continuations:
+        text = "".join(parts)
+        request = continuation_messages(messages, text)
+        try:
+            budget_max_tokens(model, request, max_tokens)
+        except ContextWindowExceededError:
+            return
+        continuations += 1
+        pieces = stitch_stream(text, _stream_once(model, request, temperature, max_tokens, use_cache,
+                                                  continuation=True))
+        finish_reason = yield from _collect(pieces, parts)
+
+
+def _stream_once(model, messages, temperature, max_tokens, use_cache, continuation=False):
+    max_tokens = budget_max_tokens(model, messages, max_tokens)
+    key = ResponseCache.make_key(model, messages, temperature, max_tokens)
+    with telemetry.span("model_call", model=model, max_tokens=max_tokens, stream=True) as span:
+        if continuation:
+            _count_continuation(span)
+        cache = get_cache() if use_cache and cache_enabled() else None
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                span.set("cache", "hit")
+                yield cached['choices'][0]['message']['content']
+                return cached['choices'][0].get('finish_reason')
+        span.set("cache", "miss" if cache is not None else "off")
+
+        def open_stream():
+            _hedge_budget.count_request()
+            policy = current_hedge_policy()
+            if policy is not None:
+                request = _hedged_request(model, messages, temperature, max_tokens, policy, span)
+                yield from request.stream()
+                _record_attempts(request, messages, span)
+                if cache is not None and request.model == model:
+                    cache.set(key, {
+                        "choices": [{
+                            "message": {"role": "assistant", "content": "".join(request.attempts[request.winner].parts)},
+                            "finish_reason": request.finish_reason,
+                        }]
+                    })
+                return request.finish_reason
+
+            parts = []
+            finish_reason = None
+            scheduler = get_scheduler()
+            tokens = estimate_tokens(messages, max_tokens, model)
+            prompt_tokens = estimate_tokens(messages, 0, model)
+            with _in_flight:
+                # Only opening the stream is retried; a failure midway surfaces to the caller.
+                chunks = scheduler.call(lambda: get_backend().create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True
+                ), tokens, span=span)
+
+                try:
+                    for chunk in chunks:
+                        choice = chunk['choices'][0]
+                        content = choice['delta'].get('content')
+                        if content:
+                            parts.append(content)
+                            yield content
+                        finish_reason = choice.get('finish_reason') or finish_reason
+                finally:
+                    # Streamed responses carry no usage, so it is estimated from the text.
+                    text = "".join(parts)
+                    completion_tokens = count_tokens(text, model)
+                    scheduler.settle(tokens, prompt_tokens + completion_tokens)
+
+            _record_usage(prompt_tokens, completion_tokens)
+            _record_span_usage(span, model, prompt_tokens, completion_tokens)
+
+            if cache is not None:
+                cache.set(key, {
+                    "choices": [{
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": finish_reason,
+                    }]
+                })
+            return finish_reason
+
+        if use_cache:
+            pieces, shared = _single_flight.stream(key + ":stream", open_stream)
+            if shared:
+                span.set("cache", "coalesced")
+        else:
+            pieces = open_stream()
+
+        try:
+            first = True
+            while True:
+                try:
+                    piece = next(pieces)
+                except StopIteration as stop:
+                    return stop.value
+                if first:
+                    span.set("time_to_first_token", span.elapsed())
+                    first = False
+                yield piece
+        finally:
+            # Tell callers following this stream when it is abandoned midway.
+            pieces.close()
@@ -0,0 +1,369 @@
+import argparse
+import os
+import re
+import sys
+import time
+from bisect import bisect_right
+from collections import Counter, deque
+import telemetry
+from Constants import (GPT_MODEL, BOILERPLATE_EDGE_LINES, BOILERPLATE_MIN_PAGES, BOILERPLATE_PAGE_FRACTION,
+                       BOILERPLATE_SAMPLE_PAGES, CERTIFICATE_MAX_LINES, COMPACT_MAX_TURN_CHARS)
+from tokens import count_tokens
+from transcript import (SPEAKER_TURN, TranscriptLine, chunk_transcript_lines, iter_transcript_lines,
+                        parse_transcript_lines)
+
+CERTIFICATE = re.compile(
+    r"^\s*(?:CERTIFICATE\s+OF\s+(?:COURT\s+)?(?:REPORTER|OATH|TRANSCRIBER)|(?:COURT\s+)?REPORTER'?S\s+CERTIFICATE)",
+    re.IGNORECASE,
+)
+# Clock times at the start of a line or in brackets, e.g. "10:32:05" or "[10:32 a.m.]".
+TIMESTAMP = re.compile(
+    r"^\s*\d{1,2}:\d{2}(?::\d{2})?(?:\s*[AaPp]\.?[Mm]\.?)?\s+"
+    r"|\s*[\[(]\d{1,2}:\d{2}(?::\d{2})?(?:\s*[AaPp]\.?[Mm]\.?)?[\])]"
+)
+DIGITS = re.compile(r"\d+")
+
+
+def compaction_enabled():
+    """Return False when transcript compaction is switched off with TRANSCRIPT_COMPACTION=off."""
+    return os.getenv("TRANSCRIPT_COMPACTION", "on").lower() not in ("off", "0", "false", "no")
+
+
+class CompactLine(TranscriptLine):
+    """
+    One speaker turn of a compacted transcript.
+
+    Its anchor is the page:line where the turn starts, and the anchor of every
+    later original line is kept inline, e.g. "Q. Did you [12:4] attend?". sources
+    maps offsets in the text back to the original line each part came from.
+    """
+
+    __slots__ = ("sources",)
+
+    def __init__(self, page, line, text, page_start, speaker_turn, sources):
+        super().__init__(page, line, text, page_start, speaker_turn)
+        self.sources = sources
+
+    def locate(self, offset):
+        """Return the original page:line anchor of a character offset in the text."""
+        index = max(0, bisect_right([start for start, _ in self.sources], offset) - 1)
+        return self.sources[index][1]
+
+
+def _shape(text):
+    # Headers and footers differ only in their page numbers and dates.
+    return DIGITS.sub("#", text.lower())
+
+
+def find_boilerplate(lines, edge_lines=BOILERPLATE_EDGE_LINES, min_pages=BOILERPLATE_MIN_PAGES,
+                     page_fraction=BOILERPLATE_PAGE_FRACTION, sample_pages=BOILERPLATE_SAMPLE_PAGES):
+    """
+    Find running headers and footers: lines repeated near the top or bottom of many pages.
+
+    Only the first sample_pages pages are read, since running headers and footers
+    repeat throughout the transcript.
+
+    Args:
+        lines (iterable): TranscriptLine objects in order.
+        edge_lines (int): Number of lines at the top and bottom of a page that are checked.
+        min_pages (int): Minimum number of pages a line must repeat on.
+        page_fraction (float): Minimum fraction of the sampled pages a line must repeat on.
+        sample_pages (int): Number of pages read.
+
+    Returns:
+        frozenset: Shapes of the boilerplate lines, as produced by _shape.
+    """
+    counts = Counter()
+    pages = 0
+    page = None
+    top = []
+    bottom = deque(maxlen=edge_lines)
+
+    def count_page():
+        counts.update({_shape(kept.text) for kept in top + list(bottom) if not kept.speaker_turn})
+
+    for line in lines:
+        if line.page != page:
+            if page is not None:
+                count_page()
+            if pages == sample_pages:
+                page = None
+                break
+            pages += 1
+            page = line.page
+            top = []
+            bottom.clear()
+        if len(top) < edge_lines:
+            top.append(line)
+        else:
+            bottom.append(line)
+    if page is not None:
+        count_page()
+
+    threshold = max(min_pages, page_fraction * pages)
+    return frozenset(shape for shape, count in counts.items() if count >= threshold)
+
+
+def _in_certificate(line, previous, skipped, max_lines):
+    # A certification is one block: it ends at a speaker turn, a blank line or a new page.
+    return (skipped < max_lines and not line.speaker_turn and line.page == previous.page
+            and line.line == previous.line + 1)
+
+
+def compact_lines(lines, boilerplate=frozenset(), max_chars=COMPACT_MAX_TURN_CHARS,
+                  certificate_lines=CERTIFICATE_MAX_LINES):
+    """
+    Compact anchored transcript lines into one line per speaker turn.
+
+    If every line would be removed, the lines are yielded as they are instead, so
+    a non-empty transcript never compacts to nothing.
+
+    Args:
+        lines (iterable): TranscriptLine objects in order.
+        boilerplate (frozenset): Header and footer shapes from find_boilerplate.
+        max_chars (int): Turns longer than this are continued on a new line.
+        certificate_lines (int): Most lines removed after a certification heading.
+
+    Yields:
+        CompactLine: The speaker turns in order.
+    """
+    parts = []
+    sources = []
+    size = 0
+    first = None
+    label = None
+    certificate = None
+    skipped = 0
+    # Lines read before the first turn is yielded, kept for the fallback.
+    held = []
+
+    def flush():
+        return CompactLine(first.page, first.line, " ".join(parts), first.page_start,
+                           bool(SPEAKER_TURN.match(parts[0])), sources)
+
+    for line in lines:
+        if held is not None:
+            held.append(line)
+        if certificate is not None:
+            if _in_certificate(line, certificate, skipped, certificate_lines):
+                certificate = line
+                skipped += 1
+                continue
+            certificate = None
+        text = line.text
+        if CERTIFICATE.match(text):
+            certificate = line
+            skipped = 0
+            continue
+        if boilerplate and _shape(text) in boilerplate:
+            continue
+        if ":" in text and (text[0].isdigit() or "[" in text or "(" in text):
+            text = TIMESTAMP.sub("", text).strip()
+            if not text:
+                continue
+
+        turn = SPEAKER_TURN.match(text)
+        if turn:
+            if turn.group(0) == label and parts:
+                # The same speaker again, e.g. after a page break: drop the repeated label.
+                text = text[turn.end():].lstrip() or text
+            else:
+                label = turn.group(0)
+                if parts:
+                    held = None
+                    yield flush()
+                    parts, sources, size, first = [], [], 0, None
+        if parts and size + len(text) > max_chars:
+            held = None
+            yield flush()
+            parts, sources, size, first = [], [], 0, None
+
+        if first is None:
+            first = line
+        else:
+            # Every original line keeps its anchor, so findings can still cite the exact line.
+            text = f"[{line.anchor}] {text}"
+        sources.append((size, line.anchor))
+        parts.append(text)
+        size += len(text) + 1
+
+    if parts:
+        yield flush()
+    elif held:
+        for line in held:
+            yield CompactLine(line.page, line.line, line.text, line.page_start, line.speaker_turn,
+                              [(0, line.anchor)])
+
+
+def iter_compact_transcript(path):
+    """
+    Stream a transcript file as compacted speaker turns.
+
+    The first pages are read once to find headers and footers, then the whole file is
+    streamed, so memory use does not grow with the size of the transcript.
+    """
+    with telemetry.span("find_boilerplate") as span:
+        boilerplate = find_boilerplate(iter_transcript_lines(path))
+        span.set("shapes", len(boilerplate))
+    return compact_lines(iter_transcript_lines(path), boilerplate)
+
+
+def iter_compact_transcript_chunks(path, **options):
+    """Compact a transcript file and split it into chunks; options are passed to chunk_transcript_lines."""
+    return chunk_transcript_lines(iter_compact_transcript(path), **options)
+
+
+def iter_compact_text_chunks(text, **options):
+    """Compact a transcript held in a string and split it into chunks, like iter_compact_transcript_chunks."""
+    raw_lines = text.splitlines()
+    boilerplate = find_boilerplate(parse_transcript_lines(raw_lines))
+    return chunk_transcript_lines(compact_lines(parse_transcript_lines(raw_lines), boilerplate), **options)
+
+
+class CompactTranscript:
+    """
+    A compacted transcript held in memory, with its offset map and token savings.
+
+    Attributes:
+        text (str): The compacted transcript, one speaker turn per line, with the
+                    [page:line] anchor of every original line inline.
+        original_tokens (int): Tokens of the transcript before compaction.
+        compact_tokens (int): Tokens of the compacted text.
+    """
+
+    def __init__(self, lines, original_tokens, model=GPT_MODEL):
+        rendered = []
+        self._offsets = []
+        self._anchors = []
+        offset = 0
+        for line in lines:
+            text = line.render()
+            start = offset + len(text) - len(line.text)
+            for part_offset, anchor in line.sources:
+                self._offsets.append(start + part_offset)
+                self._anchors.append(anchor)
+            rendered.append(text)
+            offset += len(text) + 1
+        self.text = "\n".join(rendered)
+        self.original_tokens = original_tokens
+        self.compact_tokens = count_tokens(self.text, model)
+
+    @property
+    def saved_tokens(self):
+        return self.original_tokens - self.compact_tokens
+
+    def locate(self, offset):
+        """Return the original page:line anchor of a character offset in text, or None before the first turn."""
+        index = bisect_right(self._offsets, offset) - 1
+        return self._anchors[index] if index >= 0 else None
+
+    def report(self):
+        """Token savings as a dict of original_tokens, compact_tokens, saved_tokens and saved_fraction."""
+        return {
+            "original_tokens": self.original_tokens,
+            "compact_tokens": self.compact_tokens,
+            "saved_tokens": self.saved_tokens,
+            "saved_fraction": round(self.saved_tokens / self.original_tokens, 4) if self.original_tokens else 0.0,
+        }
+
+
+def compact_text(transcript, model=GPT_MODEL):
+    """
+    Compact a transcript held in a string.
+
+    Args:
+        transcript (str): Full transcript of the hearing.
+        model (str): Model whose tokenizer is used for the savings report.
+
+    Returns:
+        CompactTranscript: The compacted text, its offset map and token savings.
+    """
+    with telemetry.span("compact_transcript") as span:
+        raw_lines = transcript.splitlines()
+        boilerplate = find_boilerplate(parse_transcript_lines(raw_lines))
+        compacted = CompactTranscript(compact_lines(parse_transcript_lines(raw_lines), boilerplate),
+                                      count_tokens(transcript, model), model)
+        span.set("original_tokens", compacted.original_tokens)
+        span.set("compact_tokens", compacted.compact_tokens)
+        return compacted
+
+
+def _count_in_blocks(texts, model, block_chars=1 << 20):
+    # Count tokens a block at a time so large files are never held in memory whole.
+    total = 0
+    block = []
+    size = 0
+    for text in texts:
+        block.append(text)
+        size += len(text)
+        if size >= block_chars:
+            total += count_tokens("".join(block), model)
+            block, size = [], 0
+    return total + count_tokens("".join(block), model)
+
+
+def compact_file(path, output_path=None, model=GPT_MODEL):
+    """
+    Compact a transcript file and report the savings, optionally writing the compacted text.
+
+    Args:
+        path (str): Path of the transcript text file.
+        output_path (str): Where to write the compacted transcript, or None.
+        model (str): Model whose tokenizer is used for the savings report.
+
+    Returns:
+        dict: Bytes, seconds, original_tokens, compact_tokens, saved_tokens and saved_fraction.
+    """
+    started = time.perf_counter()
+    with open(path, encoding="utf-8", errors="replace") as handle:
+        original_tokens = _count_in_blocks(handle, model)
+    output = open(output_path, "w", encoding="utf-8") if output_path else None
+    try:
+        def rendered():
+            for line in iter_compact_transcript(path):
+                text = line.render() + "\n"
+                if output is not None:
+                    output.write(text)
+                yield text
+        compact_tokens = _count_in_blocks(rendered(), model)
+    finally:
+        if output is not None:
+            output.close()
+    saved = original_tokens - compact_tokens
+    return {
+        "bytes": os.path.getsize(path),
+        "seconds": round(time.perf_counter() - started, 3),
+        "original_tokens": original_tokens,
+        "compact_tokens": compact_tokens,
+        "saved_tokens": saved,
+        "saved_fraction": round(saved / original_tokens, 4) if original_tokens else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compact hearing transcripts and report the token savings.")
+    parser.add_argument("transcripts", nargs="+", help="transcript text files")
+    parser.add_argument("--output-dir", help="write each compacted transcript to this directory")
+    args = parser.parse_args(argv)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    total_bytes = total_seconds = total_original = total_compact = 0
+    for path in args.transcripts:
+        output_path = os.path.join(args.output_dir, os.path.basename(path)) if args.output_dir else None
+        result = compact_file(path, output_path)
+        print(f"{path}: {result['original_tokens']} -> {result['compact_tokens']} tokens "
+              f"({result['saved_fraction']:.1%} saved) in {result['seconds']}s")
+        total_bytes += result["bytes"]
+        total_seconds += result["seconds"]
+        total_original += result["original_tokens"]
+        total_compact += result["compact_tokens"]
+    if total_original:
+        print(f"Total: {total_original} -> {total_compact} tokens "
+              f"({(total_original - total_compact) / total_original:.1%} saved), "
+              f"{total_bytes / 1e6 / max(total_seconds, 1e-9):.1f} MB/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
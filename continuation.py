@@ -0,0 +1,128 @@
+from Constants import CONTINUATION_TAIL_CHARS, CONTINUATION_OVERLAP_CHARS, CONTINUATION_MIN_OVERLAP_CHARS
+
+CONTINUE_PROMPT = (
+    "Your previous response was cut off by the length limit; its last part is quoted above. "
+    "Continue exactly where it stops, mid-sentence if need be. Do not repeat any of it, "
+    "and do not add an introduction or a summary of what came before."
+)
+
+
+class CompletionText(str):
+    """
+    Text of a model response that may have been assembled from continuation requests.
+
+    Behaves as a plain str, so it can be rendered, checkpointed and sent on to later
+    stages unchanged.
+
+    Attributes:
+        continuations (int): Continuation requests needed after the first response.
+        truncated (bool): True if the text was still cut off when the continuation cap was reached.
+    """
+
+    def __new__(cls, text, continuations=0, truncated=False):
+        completion = super().__new__(cls, text)
+        completion.continuations = continuations
+        completion.truncated = truncated
+        return completion
+
+
+def continuation_messages(messages, text, tail_chars=CONTINUATION_TAIL_CHARS):
+    """
+    Build the request that continues a response cut off by the length limit.
+
+    The original messages are sent again unchanged, so the instructions and inputs stay
+    in view and the shared prefix can be served from the provider's prompt cache. Of
+    the text generated so far only the last tail_chars characters are sent, cut at a
+    word boundary.
+
+    Args:
+        messages (list): Chat messages of the original request.
+        text (str): The response generated so far.
+        tail_chars (int): Number of trailing characters of text to send.
+
+    Returns:
+        list: Chat messages for the continuation request.
+    """
+    tail = text
+    if len(text) > tail_chars:
+        tail = text[-tail_chars:]
+        space = tail.find(" ")
+        if 0 <= space < len(tail) - 1:
+            tail = tail[space + 1:]
+    return list(messages) + [
+        {"role": "assistant", "content": tail},
+        {"role": "user", "content": CONTINUE_PROMPT},
+    ]
+
+
+def trim_overlap(text, continuation, max_overlap=CONTINUATION_OVERLAP_CHARS,
+                 min_overlap=CONTINUATION_MIN_OVERLAP_CHARS):
+    """
+    Drop the start of a continuation where it repeats the end of the text it continues.
+
+    Args:
+        text (str): The response generated so far.
+        continuation (str): Text of the continuation request.
+        max_overlap (int): Longest repeat that is looked for.
+        min_overlap (int): Shorter matches are kept, since they are likely coincidental.
+
+    Returns:
+        str: The continuation without the repeated part.
+    """
+    for size in range(min(len(text), len(continuation), max_overlap), min_overlap - 1, -1):
+        if text.endswith(continuation[:size]):
+            return continuation[size:]
+    return continuation
+
+
+def stitch(text, continuation):
+    """Append a continuation to the text it continues, without the part it repeats."""
+    return text + trim_overlap(text, continuation)
+
+
+def stitch_stream(text, pieces, max_overlap=CONTINUATION_OVERLAP_CHARS):
+    """
+    Stream a continuation of text without the part it repeats.
+
+    The first max_overlap characters are held back until it is known how much of them
+    repeats the end of text; the rest is passed through as it arrives.
+
+    Args:
+        text (str): The response generated so far.
+        pieces (iterator): Pieces of the continuation.
+        max_overlap (int): Longest repeat that is looked for.
+
+    Yields:
+        str: Pieces of the continuation.
+
+    Returns:
+        The return value of pieces, e.g. its finish reason.
+    """
+    held = []
+    size = 0
+    try:
+        while True:
+            try:
+                piece = next(pieces)
+            except StopIteration as stop:
+                result = stop.value
+                break
+            if held is None:
+                yield piece
+                continue
+            held.append(piece)
+            size += len(piece)
+            if size >= max_overlap:
+                kept = trim_overlap(text, "".join(held), max_overlap)
+                held = None
+                if kept:
+                    yield kept
+        if held:
+            kept = trim_overlap(text, "".join(held), max_overlap)
+            if kept:
+                yield kept
+        return result
+    finally:
+        close = getattr(pieces, "close", None)
+        if close is not None:
+            close()
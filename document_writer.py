@@ -0,0 +1,259 @@
+import re
+import telemetry
+from Constants import SAVE_EVERY_PARAGRAPHS
+
+HEADING = re.compile(r"^(#{1,6})\s+(.*?)[\s#]*$")
+BULLET = re.compile(r"^(\s*)[-*+]\s+(.*)$")
+NUMBERED = re.compile(r"^(\s*)(\d+)[.)]\s+(.*)$")
+RULE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+BOLD = re.compile(r"\*\*(.+?)\*\*")
+
+BULLET_STYLES = ["List Bullet", "List Bullet 2", "List Bullet 3"]
+NUMBER_STYLES = ["List Number", "List Number 2", "List Number 3"]
+
+
+class StreamingDocumentWriter:
+    """
+    Render Markdown text into a .docx document line by line as it arrives.
+
+    Markdown headings become Heading styles, bullet and numbered lists become list
+    styles (every list is numbered from the number written on its first item),
+    **bold** spans become bold runs and every section starts on a new page. Indented
+    lines under a list item continue the list. Only the current line is buffered.
+
+    Args:
+        doc_filename (str): The name of the output .docx file.
+        save_every (int): Number of paragraphs between intermediate saves, or None to
+                          only save when a section ends or the writer is closed. Every
+                          save rewrites the whole file, so the interval grows to half
+                          the paragraphs written so far once that is larger.
+        save_sections (bool): Save the document whenever a section ends, so a run that
+                              stops midway still leaves a usable document.
+    """
+
+    def __init__(self, doc_filename, save_every=SAVE_EVERY_PARAGRAPHS, save_sections=True):
+        self.doc_filename = doc_filename
+        self.save_every = save_every
+        self.save_sections = save_sections
+        self.paragraphs = 0
+        self.sections = 0
+        self.words = 0
+        # Imported here so processes that never render a document do not pay for python-docx.
+        from docx import Document
+        from docx.oxml import OxmlElement
+        from docx.oxml.numbering import CT_Num
+        from docx.text.paragraph import Paragraph
+        self._doc = Document()
+        self._new_element = OxmlElement
+        self._new_num = CT_Num.new
+        self._paragraph = Paragraph
+        self._pending = ""
+        self._unsaved = 0
+        self._lists = {}
+        # python-docx resolves styles by scanning every style, and finds where to insert a
+        # paragraph or numbering instance by scanning every existing one. Style IDs are
+        # looked up once and new elements go straight before the element that ends their
+        # container, so adding a paragraph costs the same however long the document is.
+        self._style_ids = {}
+        self._abstract_num_ids = {}
+        self._next_num_id = None
+        self._body_end = self._doc.element.body.sectPr
+        self._numbering_end = None
+
+    def write(self, text):
+        """Add a piece of text; every completed line becomes a paragraph."""
+        self._pending += text
+        if "\n" not in self._pending:
+            return
+        *lines, self._pending = self._pending.split("\n")
+        for line in lines:
+            self._add_line(line)
+
+    def start_section(self, title=None):
+        """Begin a new section on a new page, with an optional title."""
+        self._flush()
+        if self.sections:
+            self._doc.add_page_break()
+        self.sections += 1
+        self._lists = {}
+        if title:
+            self._add_heading(title, 0)
+
+    def end_section(self):
+        """Finish the current section, saving the document if save_sections is set."""
+        self._flush()
+        if self.save_sections:
+            self.save()
+
+    def close(self):
+        """Write any remaining text and save the document."""
+        self._flush()
+        self.save()
+
+    def save(self):
+        self._doc.save(self.doc_filename)
+        self._unsaved = 0
+
+    def _flush(self):
+        if self._pending:
+            self._add_line(self._pending)
+            self._pending = ""
+
+    def _add_line(self, line):
+        if not line.strip() or RULE.match(line):
+            return
+
+        heading = HEADING.match(line)
+        if heading:
+            self._lists = {}
+            text = BOLD.sub(r"\1", heading.group(2))
+            self.words += len(text.split())
+            self._add_heading(text, min(len(heading.group(1)), 9))
+            return
+
+        bullet = BULLET.match(line)
+        numbered = None if bullet else NUMBERED.match(line)
+        if bullet:
+            level = self._list_level(bullet.group(1))
+            paragraph = self._add_runs(bullet.group(2), BULLET_STYLES[level])
+        elif numbered:
+            level = self._list_level(numbered.group(1))
+            paragraph = self._add_runs(numbered.group(3), NUMBER_STYLES[level])
+            self._number(paragraph, level, NUMBER_STYLES[level], int(numbered.group(2)))
+        else:
+            # An indented line under a list item continues the item; anything else ends the lists.
+            if not (self._lists and line[:1].isspace()):
+                self._lists = {}
+            self._add_runs(line.strip(), None)
+        self._added()
+
+    @staticmethod
+    def _list_level(indent):
+        return min(len(indent.expandtabs(4)) // 2, 2)
+
+    def _style_id(self, name):
+        style_id = self._style_ids.get(name)
+        if style_id is None:
+            style_id = self._style_ids[name] = self._doc.styles[name].style_id
+        return style_id
+
+    def _add_paragraph(self, style):
+        if self._body_end is None:
+            paragraph = self._doc.add_paragraph()
+        else:
+            p = self._new_element("w:p")
+            self._body_end.addprevious(p)
+            paragraph = self._paragraph(p, self._doc._body)
+        if style is not None:
+            paragraph._p.get_or_add_pPr().style = self._style_id(style)
+        return paragraph
+
+    def _add_heading(self, text, level):
+        self._add_paragraph("Title" if level == 0 else f"Heading {level}").add_run(text)
+        self._added()
+
+    def _add_runs(self, text, style):
+        paragraph = self._add_paragraph(style)
+        bold = False
+        for part in BOLD.split(text):
+            if part:
+                paragraph.add_run(part).bold = bold or None
+            bold = not bold
+        self.words += len(text.split())
+        return paragraph
+
+    def _number(self, paragraph, level, style, start):
+        # Every numbered list gets its own numbering instance, starting at the number of its first item.
+        for deeper in [key for key in self._lists if key > level]:
+            del self._lists[deeper]
+        num_id = self._lists.get(level)
+        if num_id is None:
+            numbering = self._doc.part.numbering_part.element
+            abstract_id = self._abstract_num_ids.get(style)
+            if abstract_id is None:
+                style_num_id = self._doc.styles[style].element.pPr.numPr.numId.val
+                abstract_id = numbering.num_having_numId(style_num_id).abstractNumId.val
+                self._abstract_num_ids[style] = abstract_id
+            if self._next_num_id is None:
+                self._next_num_id = max((int(value) for value in numbering.xpath("./w:num/@w:numId")), default=0) + 1
+                cleanup = numbering.xpath("./w:numIdMacAtCleanup")
+                self._numbering_end = cleanup[0] if cleanup else None
+            num = self._new_num(self._next_num_id, abstract_id)
+            num.add_lvlOverride(ilvl=0).add_startOverride(start)
+            if self._numbering_end is None:
+                numbering.append(num)
+            else:
+                self._numbering_end.addprevious(num)
+            num_id = self._lists[level] = self._next_num_id
+            self._next_num_id += 1
+        paragraph._p.get_or_add_pPr().get_or_add_numPr().get_or_add_numId().val = num_id
+
+    def _added(self):
+        self.paragraphs += 1
+        self._unsaved += 1
+        if self.save_every and self._unsaved >= max(self.save_every, self.paragraphs // 2):
+            self.save()
+
+
+def render_document(sections, doc_filename="case_analysis.docx", save_every=None, save_sections=False):
+    """
+    Render sections of Markdown text into a .docx document.
+
+    Args:
+        sections (iterable): (title, content) pairs, where content is a string or an
+                             iterable of text pieces; title may be None.
+        doc_filename (str): The name of the output .docx file.
+        save_every (int): Number of paragraphs between intermediate saves, or None.
+        save_sections (bool): Save the document after every section.
+
+    Returns:
+        StreamingDocumentWriter: The writer, with paragraph, section and word counts.
+    """
+    with telemetry.span("render_document") as span:
+        writer = StreamingDocumentWriter(doc_filename, save_every=save_every, save_sections=save_sections)
+        try:
+            for title, content in sections:
+                writer.start_section(title)
+                for piece in ([content] if isinstance(content, str) else content):
+                    writer.write(piece)
+                writer.end_section()
+        finally:
+            writer.close()
+        span.set("words", writer.words)
+        span.set("paragraphs", writer.paragraphs)
+    return writer
+
+
+def write_document_stream(pieces, doc_filename="case_analysis.docx", titles=None):
+    """
+    Write a stream of (section name, text piece) pairs to a .docx document.
+
+    The document is saved after every section and at intermediate points within a
+    section (see StreamingDocumentWriter), so an interrupted run still leaves a
+    partial document.
+
+    Args:
+        pieces (iterable): (section name, text piece) pairs, grouped by section.
+        doc_filename (str): The name of the output .docx file.
+        titles (dict): Optional mapping of section name to the title shown in the document.
+
+    Returns:
+        StreamingDocumentWriter: The writer, with paragraph, section and word counts.
+    """
+    with telemetry.span("write_document_stream") as span:
+        writer = StreamingDocumentWriter(doc_filename)
+        try:
+            current = None
+            for section, text in pieces:
+                if section != current:
+                    if current is not None:
+                        writer.end_section()
+                    writer.start_section((titles or {}).get(section))
+                    current = section
+                writer.write(text)
+        finally:
+            writer.close()
+        span.set("words", writer.words)
+        span.set("paragraphs", writer.paragraphs)
+    print(f"Document saved as {doc_filename}. It contains {writer.sections} sections.")
+    return writer
@@ -0,0 +1,261 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from Constants import (HEDGE_FIRST_TOKEN_SECONDS, HEDGE_STALL_SECONDS, HEDGE_FALLBACK_MODEL, HEDGE_MAX_FRACTION,
+                       HEDGE_REQUEST_TIMEOUT)
+
+_local = threading.local()
+
+
+class HedgePolicy:
+    """
+    When to send a duplicate of a slow model request.
+
+    Args:
+        first_token_seconds (float): Hedge if no text has arrived after this long.
+        stall_seconds (float): Hedge if a response stops producing text for this long;
+                               only used when the caller waits for the whole response.
+        fallback_model (str): Model for the duplicate request; None uses the same model.
+        request_timeout (float): Seconds an attempt may wait for the next data from the API
+                                 before failing, so a cancelled attempt that is stuck gives
+                                 back its request slot.
+    """
+
+    def __init__(self, first_token_seconds=HEDGE_FIRST_TOKEN_SECONDS, stall_seconds=HEDGE_STALL_SECONDS,
+                 fallback_model=HEDGE_FALLBACK_MODEL, request_timeout=HEDGE_REQUEST_TIMEOUT):
+        self.first_token_seconds = first_token_seconds
+        self.stall_seconds = stall_seconds
+        self.fallback_model = fallback_model
+        self.request_timeout = request_timeout
+
+
+class HedgeBudget:
+    """
+    Cap hedges at a fraction of all model requests, so they cannot eat the rate budget.
+
+    One hedge is always allowed, so single cases can hedge too.
+
+    Args:
+        max_fraction (float): Largest share of requests that may be hedges.
+    """
+
+    def __init__(self, max_fraction=HEDGE_MAX_FRACTION):
+        self.max_fraction = max_fraction
+        self.requests = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def try_hedge(self):
+        """Take one hedge from the budget; returns False when the cap is reached."""
+        with self._lock:
+            if self.hedges >= self.max_fraction * self.requests + 1:
+                return False
+            self.hedges += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "hedges": self.hedges}
+
+
+@contextmanager
+def hedge_requests(policy):
+    """Hedge the model requests made by the current thread with the given HedgePolicy; None disables it."""
+    previous = getattr(_local, "policy", None)
+    _local.policy = policy
+    try:
+        yield
+    finally:
+        _local.policy = previous
+
+
+def current_hedge_policy():
+    """Return the HedgePolicy set with hedge_requests for the current thread, or None."""
+    return getattr(_local, "policy", None)
+
+
+class _Attempt:
+    __slots__ = ("model", "parts", "finish_reason", "sent", "first_token", "last_progress", "failed")
+
+    def __init__(self, model):
+        self.model = model
+        self.sent = False
+        self.parts = []
+        self.finish_reason = None
+        self.first_token = None
+        self.last_progress = time.monotonic()
+        self.failed = None
+
+
+class HedgedRequest:
+    """
+    Race a streamed model request against a duplicate started when the first one is slow.
+
+    Each attempt streams on its own thread. The first attempt to finish (or, when
+    streaming to the caller, the first to produce text) wins, and the other is
+    cancelled: its thread stops reading and closes the stream at the next chunk,
+    and an attempt not yet sent, or failed and waiting to be retried, is not sent.
+
+    Args:
+        open_stream (callable): Called with a model name, a callback to run just before
+                                the request is sent and a threading.Event set when the
+                                attempt is cancelled; returns an iterator of ChatCompletion
+                                stream chunks. Time spent queueing for rate limit budget
+                                before the callback does not count towards hedging.
+        model (str): Model of the first attempt.
+        policy (HedgePolicy): When to hedge, and with which model.
+        budget (HedgeBudget): Shared cap on the number of hedges.
+        span (Span): Telemetry span that receives hedge counts and the winning model.
+    """
+
+    def __init__(self, open_stream, model, policy, budget, span):
+        self.open_stream = open_stream
+        self.policy = policy
+        self.budget = budget
+        self.span = span
+        self.attempts = []
+        self.winner = None
+        self._events = queue.Queue()
+        self._cancelled = []
+        self._start(model)
+
+    def _start(self, model):
+        index = len(self.attempts)
+        self.attempts.append(_Attempt(model))
+        cancelled = threading.Event()
+        self._cancelled.append(cancelled)
+        threading.Thread(target=self._pump, args=(index, model, cancelled), daemon=True).start()
+
+    def _pump(self, index, model, cancelled):
+        try:
+            chunks = self.open_stream(model, lambda: self._events.put((index, "sent", None)), cancelled)
+            try:
+                for chunk in chunks:
+                    if cancelled.is_set():
+                        return
+                    self._events.put((index, "chunk", chunk))
+            finally:
+                close = getattr(chunks, "close", None)
+                if close is not None:
+                    close()
+            self._events.put((index, "done", None))
+        except Exception as e:
+            self._events.put((index, "error", e))
+
+    def _hedge_deadline(self, collect):
+        # Only the first attempt is ever hedged.
+        if len(self.attempts) > 1:
+            return None
+        first = self.attempts[0]
+        if not first.sent:
+            return None
+        if first.first_token is None:
+            return first.last_progress + self.policy.first_token_seconds
+        if collect:
+            return first.last_progress + self.policy.stall_seconds
+        return None
+
+    def _next_event(self, collect):
+        while True:
+            deadline = self._hedge_deadline(collect)
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                return self._events.get(timeout=timeout)
+            except queue.Empty:
+                model = self.policy.fallback_model or self.attempts[0].model
+                if self.budget.try_hedge():
+                    self.span.add("hedges", 1)
+                    self.span.set("hedge_model", model)
+                    self._start(model)
+                else:
+                    # Over the cap: keep waiting for the first attempt only.
+                    self.attempts.append(None)
+
+    def _live(self):
+        return [index for index, attempt in enumerate(self.attempts)
+                if attempt is not None and attempt.failed is None and index != self.winner]
+
+    def _handle(self, index, kind, payload):
+        attempt = self.attempts[index]
+        if kind == "sent":
+            attempt.sent = True
+            attempt.last_progress = time.monotonic()
+            return None
+        if kind == "chunk":
+            choice = payload['choices'][0]
+            content = choice['delta'].get('content')
+            attempt.last_progress = time.monotonic()
+            if content:
+                if attempt.first_token is None:
+                    attempt.first_token = attempt.last_progress
+                attempt.parts.append(content)
+            attempt.finish_reason = choice.get('finish_reason') or attempt.finish_reason
+            return content
+        if kind == "error":
+            attempt.failed = payload
+            if not self._live() and self.winner is None:
+                raise payload
+        return None
+
+    def _win(self, index):
+        self.winner = index
+        for other, cancelled in enumerate(self._cancelled):
+            if other != index:
+                cancelled.set()
+        self.span.set("hedge_won", index > 0)
+
+    def collect(self):
+        """
+        Wait for the first attempt to finish.
+
+        Returns:
+            str: The text of the winning response.
+        """
+        while True:
+            index, kind, payload = self._next_event(collect=True)
+            if self.attempts[index].failed is not None:
+                continue
+            self._handle(index, kind, payload)
+            if kind == "done":
+                self._win(index)
+                return "".join(self.attempts[index].parts)
+
+    def stream(self):
+        """
+        Yield the text of the first attempt to produce any, as it is generated.
+
+        Yields:
+            str: Pieces of the winning response.
+        """
+        try:
+            while True:
+                index, kind, payload = self._next_event(collect=False)
+                if self.winner is not None and index != self.winner:
+                    continue
+                content = self._handle(index, kind, payload)
+                if self.winner is None and (content or kind == "done"):
+                    self._win(index)
+                if self.winner == index:
+                    if content:
+                        yield content
+                    if kind == "done":
+                        return
+                    if kind == "error":
+                        raise payload
+        finally:
+            for cancelled in self._cancelled:
+                cancelled.set()
+
+    @property
+    def model(self):
+        """Model of the winning attempt."""
+        return self.attempts[self.winner].model
+
+    @property
+    def finish_reason(self):
+        return self.attempts[self.winner].finish_reason
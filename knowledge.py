@@ -0,0 +1,325 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import telemetry
+from Constants import GPT_MODEL, KNOWLEDGE_DIR, KNOWLEDGE_MAX_TOKENS, MAX_CONCURRENT_STAGES
+from client import create_chat_completion
+from continuation import CompletionText
+
+# The first messages of every request that uses the knowledge blocks. They are the same
+# for every case and both stages, so the provider can serve them from its prompt cache.
+SYSTEM_PROMPT = "You are a legal assistant specializing in appeals for ESE cases."
+REFERENCE_INTRO = (
+    "Reference material on the federal law that applies to every Exceptional Student Education (ESE) "
+    "appeal of a DOAH decision. This material already appears in the brief as written below; build on it, "
+    "cite it where useful, and do not restate it.\n\n"
+)
+
+
+class Topic:
+    """
+    A case-independent section of the brief, generated once and reused for every case.
+
+    Args:
+        statute (str): Statute or body of law the topic belongs to, e.g. "idea".
+        topic (str): Topic within the statute, e.g. "fape".
+        title (str): Heading of the section in the document.
+        instructions (str): What the section must cover, sent to the model to generate it.
+        version (int): Bump when the instructions change, so stored blocks of an older
+                       version are generated again.
+    """
+
+    __slots__ = ("statute", "topic", "title", "instructions", "version")
+
+    def __init__(self, statute, topic, title, instructions, version=1):
+        self.statute = statute
+        self.topic = topic
+        self.title = title
+        self.instructions = instructions
+        self.version = version
+
+    @property
+    def key(self):
+        return f"{self.statute}/{self.topic}"
+
+
+TOPICS = (
+    Topic("idea", "overview", "Individuals with Disabilities Education Act (IDEA)",
+          "Explain the Individuals with Disabilities Education Act (IDEA), 20 U.S.C. § 1400 et seq.: its purpose, "
+          "who is a child with a disability, the duties of state and local education agencies (including child find "
+          "and evaluations), the Individualized Education Program (IEP) and the IEP team, and the right to bring a "
+          "civil action in federal court after a due process hearing under 20 U.S.C. § 1415(i)(2)."),
+    Topic("idea", "fape", "Free Appropriate Public Education (FAPE)",
+          "Explain the Free Appropriate Public Education (FAPE) standard under IDEA: the statutory definition, the "
+          "two-part inquiry of Board of Education v. Rowley, 458 U.S. 176 (1982), and the 'appropriately ambitious' "
+          "standard of Endrew F. v. Douglas County School District RE-1, 580 U.S. 386 (2017). Distinguish procedural "
+          "from substantive denials of FAPE, and explain when a procedural violation amounts to a denial of FAPE under "
+          "20 U.S.C. § 1415(f)(3)(E)."),
+    Topic("idea", "lre", "Least Restrictive Environment (LRE)",
+          "Explain the Least Restrictive Environment (LRE) requirement of IDEA, 20 U.S.C. § 1412(a)(5): the "
+          "presumption in favor of education with nondisabled peers, the continuum of alternative placements, the "
+          "tests federal courts use to decide whether a placement complies, and how LRE interacts with FAPE."),
+    Topic("idea", "procedural_safeguards", "Procedural Safeguards under IDEA",
+          "Explain the procedural safeguards of IDEA, 20 U.S.C. § 1415: prior written notice, parental participation "
+          "in IEP meetings, independent educational evaluations at public expense, evaluation timelines, access to "
+          "records, stay-put, due process complaints and hearings, and the remedies available for violations, "
+          "including compensatory education and reimbursement."),
+    Topic("section_504", "overview", "Section 504 of the Rehabilitation Act",
+          "Explain Section 504 of the Rehabilitation Act, 29 U.S.C. § 794, and its regulations at 34 C.F.R. Part 104 "
+          "as they apply to students: who is protected, the Section 504 FAPE obligation and how it differs from IDEA, "
+          "evaluation and placement procedures, the showing of bad faith or gross misjudgment or deliberate "
+          "indifference that courts often require for damages, and exhaustion of IDEA remedies under 20 U.S.C. "
+          "§ 1415(l) after Fry v. Napoleon Community Schools, 580 U.S. 154 (2017)."),
+    Topic("ada", "title_ii", "Americans with Disabilities Act (ADA)",
+          "Explain Title II of the Americans with Disabilities Act, 42 U.S.C. § 12131 et seq., as it applies to "
+          "public schools: the prohibition of disability discrimination, reasonable modifications, effective "
+          "communication, how ADA claims relate to Section 504 and IDEA claims, the remedies available, and "
+          "exhaustion after Fry v. Napoleon Community Schools and Perez v. Sturgis Public Schools, 598 U.S. 142 (2023)."),
+    Topic("idea", "modified_de_novo", "The Modified De Novo Standard of Review",
+          "Explain the standard of review a federal district court applies in a civil action under 20 U.S.C. "
+          "§ 1415(i)(2) challenging an administrative due process decision: review of the administrative record plus "
+          "additional evidence, decision on the preponderance of the evidence, and the 'due weight' owed to the "
+          "administrative findings under Rowley (often called modified de novo review). Explain which findings get "
+          "more or less deference, which party bears the burden of proof under Schaffer v. Weast, 546 U.S. 49 (2005), "
+          "and how this standard differs from the substantial evidence and clear error standards."),
+)
+
+FRAMEWORK_TOPICS = ("idea/overview", "idea/fape", "idea/lre", "idea/procedural_safeguards", "section_504/overview",
+                    "ada/title_ii")
+STANDARD_OF_REVIEW_TOPICS = ("idea/modified_de_novo",)
+
+_topics = {topic.key: topic for topic in TOPICS}
+
+
+class KnowledgeStore:
+    """
+    Versioned local store of the knowledge blocks, one JSON file per block.
+
+    A block missing from the store, or stored for an older Topic version, is generated
+    on first use and saved, so every later case reuses it. Run "python knowledge.py
+    refresh" to generate blocks again, e.g. after a change in the law.
+
+    Args:
+        directory (str): Directory holding the block files.
+        model (str): Model used to generate blocks.
+    """
+
+    def __init__(self, directory=KNOWLEDGE_DIR, model=GPT_MODEL):
+        self.directory = directory
+        self.model = model
+        self._blocks = {}
+        self._generating = {}
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, key.replace("/", ".") + ".json")
+
+    def load(self, key):
+        """Return the stored record of a block, or None if it has never been generated."""
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as handle:
+            return json.load(handle)
+
+    def get(self, key):
+        """
+        Return the text of a block, generating it first if it is missing or outdated.
+
+        Args:
+            key (str): "statute/topic" key of one of the TOPICS.
+
+        Returns:
+            str: The Markdown text of the block, without its heading.
+        """
+        topic = _topics[key]
+        with self._lock:
+            if key in self._blocks:
+                return self._blocks[key]
+            # One lock per block, so concurrent cases wait for a single generation.
+            generating = self._generating.setdefault(key, threading.Lock())
+        with generating:
+            with self._lock:
+                if key in self._blocks:
+                    return self._blocks[key]
+            record = self.load(key)
+            if record is None or record.get("version", 0) < topic.version:
+                record = self.generate(key)
+            with self._lock:
+                self._blocks[key] = record["text"]
+            return record["text"]
+
+    def generate(self, key, use_cache=True):
+        """
+        Generate a block and save it in the store.
+
+        Args:
+            key (str): "statute/topic" key of one of the TOPICS.
+            use_cache (bool): Set to False to send a fresh request instead of reusing a cached response.
+
+        Returns:
+            dict: The stored record: statute, topic, title, version, revision, model, generated_at and text.
+        """
+        topic = _topics[key]
+        with telemetry.span("knowledge_block", topic=key):
+            prompt = (
+                "You are an expert legal assistant writing one section of a federal appeal brief in an "
+                "Exceptional Student Education (ESE) case. The section is reused in the briefs of many cases, "
+                "so it must not refer to the facts of any particular case.\n\n"
+                f"Section: {topic.title}\n\n"
+                f"{topic.instructions}\n\n"
+                "Write approximately 400 to 600 words of Markdown, using ### subheadings where helpful. "
+                "Do not include a top-level heading for the section."
+            )
+            response = create_chat_completion(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.7,
+                max_tokens=KNOWLEDGE_MAX_TOKENS,
+                use_cache=use_cache
+            )
+        previous = self.load(key)
+        record = {
+            "statute": topic.statute,
+            "topic": topic.topic,
+            "title": topic.title,
+            "version": topic.version,
+            "revision": (previous or {}).get("revision", 0) + 1,
+            "model": self.model,
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "text": response['choices'][0]['message']['content'].strip(),
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as handle:
+            json.dump(record, handle, indent=2, ensure_ascii=False)
+            handle.write("\n")
+        os.replace(temporary, path)
+        with self._lock:
+            self._blocks[key] = record["text"]
+        return record
+
+    def refresh(self, keys=None, max_workers=MAX_CONCURRENT_STAGES):
+        """
+        Generate blocks again with fresh requests and save them.
+
+        Args:
+            keys (list[str]): "statute/topic" keys to refresh; None refreshes every topic.
+            max_workers (int): Number of blocks generated at the same time.
+
+        Returns:
+            list[dict]: The new records.
+        """
+        keys = list(keys) if keys else [topic.key for topic in TOPICS]
+        unknown = [key for key in keys if key not in _topics]
+        if unknown:
+            raise ValueError(f"Unknown topics: {', '.join(unknown)}")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda key: self.generate(key, use_cache=False), keys))
+
+    def section(self, keys):
+        """Return the blocks of the given keys as Markdown sections headed by their titles."""
+        keys = list(keys)
+        with self._lock:
+            missing = [key for key in keys if key not in self._blocks]
+        if len(missing) > 1:
+            # Blocks that still have to be loaded or generated are fetched at the same time.
+            with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                list(executor.map(self.get, missing))
+        return "\n\n".join(f"## {_topics[key].title}\n\n{self.get(key)}" for key in keys)
+
+    def shared_messages(self):
+        """
+        Return the chat messages every request that uses the blocks starts with.
+
+        They hold every block in a fixed order, so they are identical for every case
+        and for both stages.
+        """
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": REFERENCE_INTRO + self.section([topic.key for topic in TOPICS])},
+        ]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_knowledge_store():
+    """Return the process-wide knowledge store, shared by all cases; KNOWLEDGE_DIR overrides its directory."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = KnowledgeStore(os.getenv("KNOWLEDGE_DIR", KNOWLEDGE_DIR))
+        return _store
+
+
+def set_knowledge_store(store):
+    """Replace the process-wide knowledge store, e.g. with one in a temporary directory in benchmarks."""
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def splice(reference, heading, answer):
+    """
+    Put the stored reference sections in front of the generated, case-specific part.
+
+    Args:
+        reference (str): Markdown sections from KnowledgeStore.section.
+        heading (str): Heading of the case-specific part.
+        answer (str): The generated text; its continuation count is kept.
+
+    Returns:
+        CompletionText: The complete section text.
+    """
+    return CompletionText(f"{reference}\n\n## {heading}\n\n{answer}", getattr(answer, "continuations", 0),
+                          getattr(answer, "truncated", False))
+
+
+def splice_stream(reference, heading, pieces):
+    """Like splice, for a generated part that is streamed: the stored sections are yielded first."""
+    yield f"{reference}\n\n## {heading}\n\n"
+    yield from pieces
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the stored statute and standard-of-review sections.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="show the stored blocks and whether they are current")
+    refresh = commands.add_parser("refresh", help="generate blocks again and store them")
+    refresh.add_argument("topics", nargs="*", help="statute/topic keys to refresh; all topics by default")
+    parser.add_argument("--directory", default=os.getenv("KNOWLEDGE_DIR", KNOWLEDGE_DIR),
+                        help="directory of the stored blocks")
+    args = parser.parse_args(argv)
+
+    store = KnowledgeStore(args.directory)
+    if args.command == "refresh":
+        for record in store.refresh(args.topics):
+            print(f"{record['statute']}/{record['topic']}: version {record['version']}, "
+                  f"revision {record['revision']}, {len(record['text'].split())} words")
+        return 0
+
+    for topic in TOPICS:
+        record = store.load(topic.key)
+        if record is None:
+            status = "missing"
+        elif record.get("version", 0) < topic.version:
+            status = f"outdated (version {record.get('version', 0)} < {topic.version})"
+        else:
+            status = (f"version {record['version']}, revision {record['revision']}, {record['model']}, "
+                      f"{record['generated_at']}, {len(record['text'].split())} words")
+        print(f"{topic.key}: {status}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,32 @@
-import os
-import openai
+import math
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import telemetry
 from dotenv import load_dotenv
-from Constants import GPT_MODEL
+from Constants import GPT_MODEL, CRITICAL_PATH_PRIORITY, HEDGE_STAGES, MAX_CONCURRENT_STAGES, PASSAGE_TOP_K, TRANSCRIPT_CHUNK_MAX_TOKENS, TRANSCRIPT_REDUCE_FANIN
+from client import create_chat_completion, stream_chat_completion
+from compaction import compact_text, compaction_enabled, iter_compact_text_chunks, iter_compact_transcript_chunks
+from document_writer import render_document, write_document_stream
+from hedging import HedgePolicy
+from knowledge import FRAMEWORK_TOPICS, STANDARD_OF_REVIEW_TOPICS, get_knowledge_store, splice, splice_stream
+from passage_index import PassageIndex, retrieval_enabled
+from pipeline import Stage, run_stages, stream_stages
+from tokens import ContextWindowExceededError, budget_max_tokens
+from transcript import iter_text_chunks, iter_transcript_chunks
 
+# The API key and endpoint are read from the environment when the first request is sent.
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
 
-def review_transcript(transcript, specific_issues):
+def _stream_answer(pieces):
+    # Errors raised while streaming surface the same way as in non-streaming calls.
+    try:
+        yield from pieces
+    except Exception as e:
+        yield f"Error: {e}"
+
+def review_transcript(transcript, specific_issues, stream=False):
     """
     Function to review a DOAH hearing transcript and identify key testimony or evidence
     that was misinterpreted, ignored, or undervalued by the hearing officer.
@@ -15,10 +34,15 @@ def review_transcript(transcript, specific_issues):
     Args:
         transcript (str): Full transcript of the DOAH hearing.
         specific_issues (str): Specific issues to focus on for review.
+        stream (bool): Return an iterator of text pieces as the response is generated.
     
     Returns:
-        str: Insights and findings from GPT-4 regarding the transcript review.
+        str: Insights and findings from GPT-4 regarding the transcript review. Transcripts
+             too long for the model's context window are reviewed in chunks.
+             Unless TRANSCRIPT_COMPACTION=off, headers, footers, certifications and
+             timestamps are stripped and each speaker turn is sent as one line.
     """
+    compact = compaction_enabled()
     try:
         prompt = (
             "Please provide me with a detailed response that is approximately 3000 to 4000 words in length."
@@ -28,19 +52,231 @@ def review_transcript(transcript, specific_issues):
             "highlighting inconsistencies between the officer’s findings and the evidence presented. "
             "\n\n"
             "Here is the transcript:\n"
-            f"{transcript}\n\n"
+            f"{compact_text(transcript).text if compact else transcript}\n\n"
             "Specific issues to focus on:\n"
             f"{specific_issues}\n\n"
             "Provide a detailed analysis, including any errors in fact, law, or procedure."
         )
         
-        response = openai.ChatCompletion.create(
+        messages = [
+            {"role": "system", "content": "You are a legal assistant specializing in appeals for ESE cases."},
+            {"role": "user", "content": prompt}
+        ]
+        # Raises ContextWindowExceededError before any request is sent if the transcript is too long.
+        budget_max_tokens(GPT_MODEL, messages, 12000)
+        if stream:
+            return _stream_answer(stream_chat_completion(GPT_MODEL, messages, 0.7, 12000))
+        
+        response = create_chat_completion(
+            model=GPT_MODEL,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=12000
+        )
+        
+        answer = response['choices'][0]['message']['content']
+        return answer
+    except ContextWindowExceededError:
+        chunks = iter_compact_text_chunks(transcript) if compact else iter_text_chunks(transcript)
+        return review_transcript_chunks(chunks, specific_issues, stream=stream)
+    except Exception as e:
+        return f"Error: {e}"
+
+def review_transcript_chunk(chunk, specific_issues):
+    """
+    Function to review one excerpt of a long DOAH hearing transcript.
+    
+    Args:
+        chunk (TranscriptChunk): Excerpt of the transcript with [page:line] anchors.
+        specific_issues (str): Specific issues to focus on for review.
+    
+    Returns:
+        str: Findings for the excerpt, citing page:line references.
+    """
+    try:
+        prompt = (
+            "You are an expert legal assistant tasked with reviewing an excerpt of the transcript "
+            "of a DOAH hearing. Identify testimony or evidence in this excerpt that may have been "
+            "misinterpreted, ignored, or undervalued by the hearing officer. Every line of the original "
+            "transcript is marked with its [page:line] reference, at the start of a line or inline where "
+            "a speaker's turn continues; cite the reference of the line each finding comes from.\n\n"
+            f"Transcript excerpt (pages {chunk.start} to {chunk.end}):\n"
+            f"{chunk.text}\n\n"
+            "Specific issues to focus on:\n"
+            f"{specific_issues}\n\n"
+            "List concise findings only. If the excerpt contains nothing relevant, say so in one sentence."
+        )
+        
+        response = create_chat_completion(
             model=GPT_MODEL,
             messages=[
                 {"role": "system", "content": "You are a legal assistant specializing in appeals for ESE cases."},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.7,
+            max_tokens=TRANSCRIPT_CHUNK_MAX_TOKENS
+        )
+        
+        answer = response['choices'][0]['message']['content']
+        return answer
+    except Exception as e:
+        return f"Error: {e}"
+
+def merge_transcript_reviews(findings, specific_issues, final=True, stream=False):
+    """
+    Function to merge per-excerpt transcript findings into a single report.
+    
+    Args:
+        findings (list[str]): Findings for consecutive excerpts of the transcript.
+        specific_issues (str): Specific issues to focus on for review.
+        final (bool): Whether this merge produces the final report or an intermediate summary.
+        stream (bool): Return an iterator of text pieces as the response is generated.
+    
+    Returns:
+        str: Merged findings that keep the page:line references.
+    """
+    try:
+        length = (
+            "Please provide me with a detailed response that is approximately 3000 to 4000 words in length."
+            if final else "Keep the merged findings concise."
+        )
+        sections = "\n\n".join(
+            f"Findings {number}:\n{finding}" for number, finding in enumerate(findings, 1)
+        )
+        prompt = (
+            f"{length}"
+            "You are an expert legal assistant tasked with reviewing the transcript "
+            "of a DOAH hearing. The transcript was reviewed in consecutive excerpts and the findings "
+            "for each excerpt are listed below. Merge them into one analysis of testimony or evidence "
+            "that was misinterpreted, ignored, or undervalued by the hearing officer. Remove duplicates "
+            "caused by overlapping excerpts and keep every page:line reference.\n\n"
+            f"{sections}\n\n"
+            "Specific issues to focus on:\n"
+            f"{specific_issues}\n\n"
+            "Provide a detailed analysis, including any errors in fact, law, or procedure."
+        )
+        
+        messages = [
+            {"role": "system", "content": "You are a legal assistant specializing in appeals for ESE cases."},
+            {"role": "user", "content": prompt}
+        ]
+        if stream:
+            return _stream_answer(stream_chat_completion(GPT_MODEL, messages, 0.7, 12000 if final else TRANSCRIPT_CHUNK_MAX_TOKENS))
+        
+        response = create_chat_completion(
+            model=GPT_MODEL,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=12000 if final else TRANSCRIPT_CHUNK_MAX_TOKENS
+        )
+        
+        answer = response['choices'][0]['message']['content']
+        return answer
+    except Exception as e:
+        return f"Error: {e}"
+
+def review_transcript_file(transcript_path, specific_issues, max_workers=MAX_CONCURRENT_STAGES, stream=False):
+    """
+    Function to review a transcript too large for a single prompt using map-reduce.
+    
+    The transcript file is streamed in overlapping chunks that are reviewed in
+    parallel; the findings are then merged, in groups if there are many, into one report.
+    
+    Args:
+        transcript_path (str): Path of the DOAH hearing transcript text file.
+        specific_issues (str): Specific issues to focus on for review.
+        max_workers (int): Maximum number of chunk reviews running at the same time.
+        stream (bool): Return an iterator of text pieces of the final report as it is generated.
+    
+    Returns:
+        str: Insights and findings regarding the transcript review, with page:line references.
+    """
+    if compaction_enabled():
+        chunks = iter_compact_transcript_chunks(transcript_path)
+    else:
+        chunks = iter_transcript_chunks(transcript_path)
+    return review_transcript_chunks(chunks, specific_issues, max_workers, stream)
+
+def review_transcript_chunks(chunks, specific_issues, max_workers=MAX_CONCURRENT_STAGES, stream=False):
+    """
+    Function to review transcript chunks in parallel and merge the findings into one report.
+    
+    Args:
+        chunks (iterable): TranscriptChunk objects in transcript order.
+        specific_issues (str): Specific issues to focus on for review.
+        max_workers (int): Maximum number of chunk reviews running at the same time.
+        stream (bool): Return an iterator of text pieces of the final report as it is generated.
+    
+    Returns:
+        str: Insights and findings regarding the transcript review, with page:line references.
+    """
+    findings = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = []
+        for chunk in chunks:
+            in_flight.append(executor.submit(review_transcript_chunk, chunk, specific_issues))
+            # Bound the number of chunks held in memory while waiting for reviews.
+            if len(in_flight) >= 2 * max_workers:
+                findings.append(in_flight.pop(0).result())
+        findings.extend(future.result() for future in in_flight)
+
+        while len(findings) > TRANSCRIPT_REDUCE_FANIN:
+            groups = [findings[i:i + TRANSCRIPT_REDUCE_FANIN] for i in range(0, len(findings), TRANSCRIPT_REDUCE_FANIN)]
+            findings = list(executor.map(lambda group: merge_transcript_reviews(group, specific_issues, final=False), groups))
+
+    if not findings:
+        return iter(["Error: the transcript is empty."]) if stream else "Error: the transcript is empty."
+    return merge_transcript_reviews(findings, specific_issues, stream=stream)
+
+def review_transcript_excerpts(index, specific_issues, top_k=PASSAGE_TOP_K, stream=False):
+    """
+    Function to review only the transcript passages most relevant to the specific issues.
+    
+    The passages are found with a local BM25 index of the transcript, so the prompt
+    carries the top matching excerpts with their page:line references instead of the
+    whole transcript.
+    
+    Args:
+        index (PassageIndex): Passage index of the DOAH hearing transcript.
+        specific_issues (str): Specific issues to focus on for review; also the search query.
+        top_k (int): Maximum number of passages sent to the model.
+        stream (bool): Return an iterator of text pieces as the response is generated.
+    
+    Returns:
+        str: Insights and findings regarding the transcript review, with page:line references.
+    """
+    try:
+        excerpts = index.excerpts(specific_issues, top_k)
+        if not excerpts:
+            error = "Error: no transcript passages match the specific issues."
+            return iter([error]) if stream else error
+        prompt = (
+            "Please provide me with a detailed response that is approximately 3000 to 4000 words in length."
+            "You are an expert legal assistant tasked with reviewing the transcript "
+            "of a DOAH hearing. The goal is to identify testimony or evidence that was "
+            "misinterpreted, ignored, or undervalued by the hearing officer. Focus on "
+            "highlighting inconsistencies between the officer’s findings and the evidence presented. "
+            "The excerpts below are the parts of the transcript most relevant to the specific issues. "
+            "Every line is prefixed with its [page:line] reference; cite these references for every finding."
+            "\n\n"
+            "Here are the transcript excerpts:\n"
+            f"{excerpts}\n\n"
+            "Specific issues to focus on:\n"
+            f"{specific_issues}\n\n"
+            "Provide a detailed analysis, including any errors in fact, law, or procedure."
+        )
+        
+        messages = [
+            {"role": "system", "content": "You are a legal assistant specializing in appeals for ESE cases."},
+            {"role": "user", "content": prompt}
+        ]
+        if stream:
+            return _stream_answer(stream_chat_completion(GPT_MODEL, messages, 0.7, 12000))
+        
+        response = create_chat_completion(
+            model=GPT_MODEL,
+            messages=messages,
+            temperature=0.7,
             max_tokens=12000
         )
         
@@ -49,55 +285,62 @@ def review_transcript(transcript, specific_issues):
     except Exception as e:
         return f"Error: {e}"
 
-def explain_legal_framework(case_description):
+def explain_legal_framework(case_description, stream=False):
     """
     Function to dynamically explain the legal framework for appealing a DOAH decision in an ESE case.
     
     Args:
         case_description (str): A brief description of the case, including key facts and issues.
+        stream (bool): Return an iterator of text pieces as the response is generated.
 
     Returns:
         str: Explanation of federal statutes and key procedural safeguards tailored to the case.
+             The case-independent explanation of IDEA, FAPE, LRE, the procedural safeguards,
+             Section 504 and the ADA comes from the knowledge store; only its application
+             to the case is generated.
     """
     try:
+        store = get_knowledge_store()
         prompt = (
-            "Please provide me with a detailed response that is approximately 3000 to 4000 words in length."
+            "Please provide me with a detailed response that is approximately 1500 to 2000 words in length."
             "You are an expert legal assistant specializing in appeals for Exceptional Student Education (ESE) cases. "
-            "Given the following case description, explain the legal framework applicable to a federal appeal: "
+            "The reference material above already explains IDEA, FAPE, LRE, the procedural safeguards, "
+            "Section 504 and the ADA. Given the following case description, apply that legal framework "
+            "to a federal appeal of this case: "
             "\n\n"
             f"Case Description:\n{case_description}\n\n"
-            "Discuss the relevant federal statutes, including:\n"
-            "1. Individuals with Disabilities Education Act (IDEA).\n"
-            "2. Section 504 of the Rehabilitation Act.\n"
-            "3. Americans with Disabilities Act (ADA).\n\n"
-            "Address procedural safeguards under IDEA, such as the Free Appropriate Public Education (FAPE) standard, "
-            "and explain how procedural or substantive violations could affect the student’s rights. "
+            "Identify which statutes and safeguards are implicated by the facts, and explain how the procedural "
+            "or substantive violations in this case could affect the student’s rights. "
             "Structure your response to align with the specific issues in the case."
         )
         
-        response = openai.ChatCompletion.create(
+        messages = store.shared_messages() + [{"role": "user", "content": prompt}]
+        reference = store.section(FRAMEWORK_TOPICS)
+        if stream:
+            return _stream_answer(splice_stream(reference, "Application to This Case",
+                                                stream_chat_completion(GPT_MODEL, messages, 0.7, 12000)))
+        
+        response = create_chat_completion(
             model=GPT_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a legal assistant specializing in appeals for ESE cases."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             temperature=0.7,
             max_tokens=12000
         )
         
         answer = response['choices'][0]['message']['content']
-        return answer
+        return splice(reference, "Application to This Case", answer)
     except Exception as e:
         return f"Error: {e}"
     
 
-def analyze_case_law(case_description):
+def analyze_case_law(case_description, stream=False):
     """
     Function to identify and analyze relevant federal case law supporting an appeal
     of a DOAH decision in an ESE case.
     
     Args:
         case_description (str): A brief description of the case, including key facts and issues.
+        stream (bool): Return an iterator of text pieces as the response is generated.
         
     Returns:
         str: Analysis of relevant federal case law, highlighting similarities and legal principles.
@@ -122,12 +365,16 @@ def analyze_case_law(case_description):
             "   - Summary of How the Identified Case Law Undermines the Hearing Officer’s Decision\n"
         )
         
-        response = openai.ChatCompletion.create(
+        messages = [
+            {"role": "system", "content": "You are a legal assistant specializing in appeals for ESE cases."},
+            {"role": "user", "content": prompt}
+        ]
+        if stream:
+            return _stream_answer(stream_chat_completion(GPT_MODEL, messages, 0.7, 12000))
+        
+        response = create_chat_completion(
             model=GPT_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a legal assistant specializing in appeals for ESE cases."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             temperature=0.7,
             max_tokens=12000
         )
@@ -137,13 +384,14 @@ def analyze_case_law(case_description):
     except Exception as e:
         return f"Error: {e}"
 
-def identify_errors_in_law_or_procedure(case_description):
+def identify_errors_in_law_or_procedure(case_description, stream=False):
     """
     Function to identify legal and procedural errors in the DOAH hearing officer's decision.
     
     Args:
         case_description (str): A detailed description of the case, including key facts, 
                                 issues, and potential legal/procedural errors.
+        stream (bool): Return an iterator of text pieces as the response is generated.
     
     Returns:
         str: Analysis of legal and procedural errors, highlighting their impact on the decision.
@@ -175,12 +423,16 @@ def identify_errors_in_law_or_procedure(case_description):
             "   - Summary of the errors and how they undermine the validity of the decision.\n"
         )
         
-        response = openai.ChatCompletion.create(
+        messages = [
+            {"role": "system", "content": "You are a legal assistant specializing in identifying errors in law or procedure for ESE appeals."},
+            {"role": "user", "content": prompt}
+        ]
+        if stream:
+            return _stream_answer(stream_chat_completion(GPT_MODEL, messages, 0.7, 12000))
+        
+        response = create_chat_completion(
             model=GPT_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a legal assistant specializing in identifying errors in law or procedure for ESE appeals."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             temperature=0.7,
             max_tokens=12000
         )
@@ -190,7 +442,7 @@ def identify_errors_in_law_or_procedure(case_description):
     except Exception as e:
         return f"Error: {e}"
 
-def apply_standard_of_review(case_issues):
+def apply_standard_of_review(case_issues, stream=False):
     """
     Function to clarify the federal court's standard of review for administrative decisions 
     and apply it to the specific issues in the case.
@@ -198,53 +450,57 @@ def apply_standard_of_review(case_issues):
     Args:
         case_issues (str): A detailed description of the issues being appealed, including 
                            legal and procedural concerns identified earlier.
+        stream (bool): Return an iterator of text pieces as the response is generated.
     
     Returns:
         str: Analysis of the applicable standard of review and its application to the case issues.
+             The explanation of the modified de novo standard comes from the knowledge store;
+             only its application to the case issues is generated.
     """
     try:
+        store = get_knowledge_store()
         prompt = (
-            "Please provide me with a detailed response that is approximately 3000 to 4000 words in length."
+            "Please provide me with a detailed response that is approximately 2000 to 3000 words in length."
             "You are a legal expert specializing in appeals for Exceptional Student Education (ESE) cases. "
-            "Given the issues described, clarify the federal court's standard of review for administrative decisions, "
-            "such as the 'modified de novo' standard. Apply this standard to the specific legal and procedural issues "
+            "The reference material above already explains the federal court's 'modified de novo' standard of "
+            "review for administrative decisions. Apply this standard to the specific legal and procedural issues "
             "raised in the appeal.\n\n"
             "Focus on:\n"
-            "1. Explanation of the 'modified de novo' standard:\n"
-            "   - How federal courts review administrative decisions, including deference to factual findings and legal conclusions.\n"
-            "   - Differences between this standard and other review standards (e.g., substantial evidence).\n"
-            "2. Application to Case Issues:\n"
             "   - Evaluate whether the hearing officer's findings align with or deviate from the proper legal and procedural standards.\n"
+            "   - Identify which findings are owed more or less deference, and why.\n"
             "   - Highlight specific issues where the officer's decision warrants reversal or modification under the standard of review.\n\n"
             "Case Issues:\n"
             f"{case_issues}\n\n"
             "Provide a structured response with:\n"
-            "1. Explanation of the Standard of Review.\n"
-            "2. Application to Case Issues.\n"
-            "3. Conclusion summarizing how the standard supports the appeal.\n"
+            "1. Application to Case Issues.\n"
+            "2. Conclusion summarizing how the standard supports the appeal.\n"
         )
         
-        response = openai.ChatCompletion.create(
+        messages = store.shared_messages() + [{"role": "user", "content": prompt}]
+        reference = store.section(STANDARD_OF_REVIEW_TOPICS)
+        if stream:
+            return _stream_answer(splice_stream(reference, "Application to the Case Issues",
+                                                stream_chat_completion(GPT_MODEL, messages, 0.7, 12000)))
+        
+        response = create_chat_completion(
             model=GPT_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a legal assistant specializing in identifying and applying the standard of review for federal appeals."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             temperature=0.7,
             max_tokens=12000
         )
         
         answer = response['choices'][0]['message']['content']
-        return answer
+        return splice(reference, "Application to the Case Issues", answer)
     except Exception as e:
         return f"Error: {e}"    
 
-def suggest_relief_sought(case_violations):
+def suggest_relief_sought(case_violations, stream=False):
     """
     Function to suggest potential remedies based on identified legal and procedural violations.
     
     Args:
         case_violations (str): Description of the legal and procedural errors impacting the student's rights.
+        stream (bool): Return an iterator of text pieces as the response is generated.
     
     Returns:
         str: Suggested relief tailored to the violations, including compensatory education, reimbursement, or directives for a new IEP meeting.
@@ -270,12 +526,16 @@ def suggest_relief_sought(case_violations):
             "3. Justification for each remedy.\n"
         )
         
-        response = openai.ChatCompletion.create(
+        messages = [
+            {"role": "system", "content": "You are a legal assistant specializing in suggesting appropriate remedies in federal appeals for ESE cases."},
+            {"role": "user", "content": prompt}
+        ]
+        if stream:
+            return _stream_answer(stream_chat_completion(GPT_MODEL, messages, 0.7, 12000))
+        
+        response = create_chat_completion(
             model=GPT_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a legal assistant specializing in suggesting appropriate remedies in federal appeals for ESE cases."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             temperature=0.7,
             max_tokens=12000
         )
@@ -285,13 +545,14 @@ def suggest_relief_sought(case_violations):
     except Exception as e:
         return f"Error: {e}"
 
-def draft_persuasive_argument(case_details, counterarguments):
+def draft_persuasive_argument(case_details, counterarguments, stream=False):
     """
     Function to draft a persuasive legal argument for a federal appeal in an ESE case.
     
     Args:
         case_details (str): Key facts and legal issues in the case.
         counterarguments (str): Anticipated counterarguments from the school district.
+        stream (bool): Return an iterator of text pieces as the response is generated.
     
     Returns:
         str: A well-written argument emphasizing the equities and addressing counterarguments.
@@ -316,12 +577,16 @@ def draft_persuasive_argument(case_details, counterarguments):
             "4. Conclusion reinforcing why the decision should be overturned."
         )
         
-        response = openai.ChatCompletion.create(
+        messages = [
+            {"role": "system", "content": "You are a legal expert assisting in drafting persuasive appellate arguments for ESE cases."},
+            {"role": "user", "content": prompt}
+        ]
+        if stream:
+            return _stream_answer(stream_chat_completion(GPT_MODEL, messages, 0.7, 12000))
+        
+        response = create_chat_completion(
             model=GPT_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a legal expert assisting in drafting persuasive appellate arguments for ESE cases."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             temperature=0.7,
             max_tokens=12000
         )
@@ -331,59 +596,101 @@ def draft_persuasive_argument(case_details, counterarguments):
     except Exception as e:
         return f"Error: {e}"
 
-from docx import Document
-import math
+# Order in which the stage outputs are assembled into the final document.
+STAGE_ORDER = [
+    "transcript_review",
+    "legal_framework",
+    "case_law",
+    "errors",
+    "standard_of_review",
+    "relief",
+    "argument",
+]
+
+# Section titles of the stages in the generated document.
+STAGE_TITLES = {
+    "transcript_review": "Review of the Hearing Transcript",
+    "legal_framework": "Legal Framework",
+    "case_law": "Analysis of Federal Case Law",
+    "errors": "Errors in Law and Procedure",
+    "standard_of_review": "Standard of Review",
+    "relief": "Relief Sought",
+    "argument": "Persuasive Argument",
+}
+
+
+def build_case_stages(case, stream=False):
+    """
+    Build the dependency graph of analysis stages for a single case.
+    
+    Args:
+        case (dict): Case inputs keyed by transcript (or transcript_path for a transcript
+                     file reviewed in chunks), specific_issues, case_description,
+                     case_description1, case_issues, case_violations, case_details
+                     and counterarguments.
+        stream (bool): Build streaming stages for stream_stages instead of run_stages.
+                       With TRANSCRIPT_RETRIEVAL=on the transcript review is sent only the
+                       passages that best match specific_issues.
+                       Requests of the stages in HEDGE_STAGES are hedged when they are slow.
+    
+    Returns:
+        list[Stage]: Stages ready to be passed to run_stages or stream_stages.
+    """
+    options = {"stream": True} if stream else {}
+
+    def standard_of_review_args(outputs):
+        errors = outputs["errors"]
+        if errors.startswith("Error:"):
+            return (case["case_issues"],)
+        return (case["case_issues"] + "\n\nErrors identified in law or procedure:\n" + errors,)
+
+    if retrieval_enabled():
+        index = PassageIndex(transcript=case.get("transcript"), transcript_path=case.get("transcript_path"))
+        transcript_stage = Stage("transcript_review", partial(review_transcript_excerpts, **options),
+                                 (index, case["specific_issues"]))
+    elif case.get("transcript_path"):
+        transcript_stage = Stage("transcript_review", partial(review_transcript_file, **options),
+                                 (case["transcript_path"], case["specific_issues"]))
+    else:
+        transcript_stage = Stage("transcript_review", partial(review_transcript, **options),
+                                 (case["transcript"], case["specific_issues"]))
+
+    stages = [
+        transcript_stage,
+        Stage("legal_framework", partial(explain_legal_framework, **options), (case["case_description"],)),
+        Stage("case_law", partial(analyze_case_law, **options), (case["case_description"],)),
+        Stage("errors", partial(identify_errors_in_law_or_procedure, **options), (case["case_description1"],),
+              priority=CRITICAL_PATH_PRIORITY),
+        Stage("standard_of_review", partial(apply_standard_of_review, **options), depends_on=("errors",),
+              build_args=standard_of_review_args),
+        Stage("relief", partial(suggest_relief_sought, **options), (case["case_violations"],)),
+        Stage("argument", partial(draft_persuasive_argument, **options),
+              (case["case_details"], case["counterarguments"])),
+    ]
+    for stage in stages:
+        if stage.name in HEDGE_STAGES:
+            stage.hedge = HedgePolicy()
+    return stages
 
 def create_pages_from_result(final_result, words_per_page=300, doc_filename="case_analysis.docx"):
     """
     Create a multi-page document (50-70 pages) from the final result string.
     
+    The Markdown structure of the result is kept as real headings and lists. To start
+    every stage on its own page, pass the stage outputs to render_document instead.
+    
     :param final_result: The complete text to be added to the document.
-    :param words_per_page: The target word count per page for splitting.
+    :param words_per_page: The word count per page used to estimate the page count.
     :param doc_filename: The name of the output .docx file.
     """
-    # Create a new document
-    doc = Document()
-    
-    # Split final result into words
-    words = final_result.split()
-    total_words = len(words)
-    
-    # Calculate number of pages needed
-    pages_needed = math.ceil(total_words / words_per_page)
-    
-    # Add content to the document, splitting based on words_per_page
-    current_page = 1
-    start_index = 0
-    while start_index < total_words:
-        # Define the end index for this page
-        end_index = min(start_index + words_per_page, total_words)
-        
-        # Create a new page
-        # doc.add_paragraph("Page %d" % current_page, style="Heading 1")
-        
-        # Add the portion of text for this page
-        page_text = " ".join(words[start_index:end_index])
-        doc.add_paragraph(page_text)
-        
-        # Prepare for the next page
-        start_index = end_index
-        current_page += 1
-        
-        # Add a page break after each page except the last one
-        if start_index < total_words:
-            doc.add_paragraph("\n")
-            doc.add_paragraph("\n")
-    
-    # Save the document
-    doc.save(doc_filename)
+    writer = render_document([(None, final_result)], doc_filename=doc_filename)
+    pages_needed = math.ceil(writer.words / words_per_page)
     print(f"Document saved as {doc_filename}. It contains {pages_needed} pages.")
 
 if __name__ == "__main__":
     transcript = "Full DOAH hearing transcript goes here."
     specific_issues = "Highlight testimony related to student assessments and procedural compliance."
     
-    result = review_transcript(transcript, specific_issues)
     case_description = (
         "The student is a 10-year-old with autism who was denied necessary speech therapy services. "
         "The hearing officer ruled that the school district's IEP was sufficient, but the family contends "
@@ -391,8 +698,6 @@ if __name__ == "__main__":
         "such as failure to consider independent evaluations, were also noted."
     )
     
-    result1 = explain_legal_framework(case_description)
-    result2 = analyze_case_law(case_description)
     case_description1 = (
         "The hearing officer denied speech therapy services for a 10-year-old student with autism, "
         "ruling that the existing IEP met FAPE standards. However, the officer relied on testimony "
@@ -401,7 +706,6 @@ if __name__ == "__main__":
         "timelines for responding to the parents' requests for evaluations."
     )
     
-    result3 = identify_errors_in_law_or_procedure(case_description1)
     case_issues = (
         "The hearing officer ruled that the student's IEP met the FAPE standard, despite substantial evidence from "
         "independent evaluations showing lack of meaningful progress in speech therapy. The officer also excluded "
@@ -409,15 +713,12 @@ if __name__ == "__main__":
         "the district's delay in responding to evaluation requests."
     )
     
-    result4 = apply_standard_of_review(case_issues)
     case_violations = (
         "The school district failed to provide FAPE by not addressing the student's speech therapy needs, despite "
         "independent evaluations showing a lack of progress. The hearing officer also excluded critical expert testimony "
         "and overlooked procedural violations, including delays in responding to evaluation requests. As a result, the "
         "student has fallen behind significantly in communication skills."
     )
-    
-    result5 = suggest_relief_sought(case_violations)
 
     case_details = (
         "The hearing officer incorrectly concluded that the district provided FAPE despite clear evidence of "
@@ -430,12 +731,31 @@ if __name__ == "__main__":
         "and that any procedural violations were harmless. They may also assert that the parent's disagreement "
         "does not invalidate the IEP."
     )
-    
-    result6 = draft_persuasive_argument(case_details, counterarguments)
 
-    # final_result = result + result1 + result2 + result3 + result4 + result5 + result6
-    # Assuming final_result is already generated from the previous results
-    final_result = result + result1 + result2 + result3 + result4 + result5 + result6
+    case = {
+        "transcript": transcript,
+        "specific_issues": specific_issues,
+        "case_description": case_description,
+        "case_description1": case_description1,
+        "case_issues": case_issues,
+        "case_violations": case_violations,
+        "case_details": case_details,
+        "counterarguments": counterarguments,
+    }
+
+    if "--stream" in sys.argv:
+        # Write each stage to the document as it is generated.
+        write_document_stream(stream_stages(build_case_stages(case, stream=True)), doc_filename="case_analysis.docx",
+                              titles=STAGE_TITLES)
+    else:
+        # Independent stages run concurrently; the standard of review waits for the errors stage.
+        results = run_stages(build_case_stages(case))
+
+        # Render every stage as its own section, starting on a new page
+        render_document(((STAGE_TITLES[name], results[name]) for name in STAGE_ORDER), doc_filename="case_analysis.docx")
+        print("Document saved as case_analysis.docx.")
 
-    # Call the function to create the pages
-    create_pages_from_result(final_result, words_per_page=300, doc_filename="case_analysis.docx")
\ No newline at end of file
+    if telemetry.is_enabled():
+        telemetry.write_json_report("run_report.json")
+        telemetry.write_prometheus("metrics.prom")
+        print("Telemetry written to run_report.json and metrics.prom.")
@@ -0,0 +1,253 @@
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+import telemetry
+from Constants import PASSAGE_INDEX_DIR, PASSAGE_LINES, PASSAGE_OVERLAP_LINES, PASSAGE_TOP_K, BM25_K1, BM25_B
+from transcript import iter_transcript_lines, parse_transcript_lines
+
+# Bump when the passage layout or tokenizer changes, so old indexes are rebuilt.
+INDEX_VERSION = 2
+
+TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from had has have he her his i in is it its me my no not "
+    "of on or q our she so that the their them then there they this to was we were what when which who "
+    "will with would yes you your".split()
+)
+
+
+def retrieval_enabled():
+    """Return True when transcript retrieval is switched on with TRANSCRIPT_RETRIEVAL=on."""
+    return os.getenv("TRANSCRIPT_RETRIEVAL", "off").lower() in ("on", "1", "true", "yes")
+
+
+def tokenize(text):
+    """
+    Split text into index terms.
+
+    Terms are lowercase words and numbers without stopwords; a trailing plural "s"
+    is dropped so that "assessments" matches "assessment".
+    """
+    terms = []
+    for term in TOKEN.findall(text.lower()):
+        if term in STOPWORDS:
+            continue
+        if len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+            term = term[:-1]
+        terms.append(term)
+    return terms
+
+
+class Passage:
+    """
+    A window of consecutive transcript lines returned by a search.
+
+    Attributes:
+        position (int): Ordinal of the first line in the transcript.
+        start (str): page:line anchor of the first line.
+        end (str): page:line anchor of the last line.
+        lines (list[str]): The lines, each prefixed by its [page:line] anchor.
+        score (float): BM25 score for the query.
+    """
+
+    __slots__ = ("position", "start", "end", "lines", "score")
+
+    def __init__(self, position, start, end, lines, score=0.0):
+        self.position = position
+        self.start = start
+        self.end = end
+        self.lines = lines
+        self.score = score
+
+
+def iter_passages(lines, size=PASSAGE_LINES, overlap=PASSAGE_OVERLAP_LINES):
+    """
+    Group anchored transcript lines into overlapping passages.
+
+    Args:
+        lines (iterable): TranscriptLine objects in order.
+        size (int): Number of lines in a passage.
+        overlap (int): Number of lines shared by consecutive passages.
+
+    Yields:
+        Passage: The passages in transcript order.
+    """
+    window = []
+    position = 0
+    for line in lines:
+        window.append(line)
+        if len(window) < size:
+            continue
+        yield Passage(position, window[0].anchor, window[-1].anchor, [kept.render() for kept in window])
+        step = max(1, size - overlap)
+        window = window[step:]
+        position += step
+    if window and (position == 0 or len(window) > overlap):
+        yield Passage(position, window[0].anchor, window[-1].anchor, [kept.render() for kept in window])
+
+
+def _digest_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PassageIndex:
+    """
+    BM25 index over page/line-anchored passages of one transcript, persisted in SQLite.
+
+    The index is built on the first search and stored under a hash of the transcript,
+    so later runs over the same transcript open it without re-indexing.
+
+    Args:
+        transcript (str): Transcript text; pass either this or transcript_path.
+        transcript_path (str): Path of the transcript text file.
+        directory (str): Directory holding the index files.
+        size (int): Number of lines in a passage.
+        overlap (int): Number of lines shared by consecutive passages.
+    """
+
+    def __init__(self, transcript=None, transcript_path=None, directory=PASSAGE_INDEX_DIR,
+                 size=PASSAGE_LINES, overlap=PASSAGE_OVERLAP_LINES):
+        if (transcript is None) == (transcript_path is None):
+            raise ValueError("Pass either transcript or transcript_path.")
+        self.transcript = transcript
+        self.transcript_path = transcript_path
+        self.directory = directory
+        self.size = size
+        self.overlap = overlap
+        self.path = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _lines(self):
+        if self.transcript_path is not None:
+            return iter_transcript_lines(self.transcript_path)
+        return parse_transcript_lines(self.transcript.splitlines())
+
+    def _open(self):
+        if self._conn is not None:
+            return self._conn
+        if self.transcript_path is not None:
+            digest = _digest_file(self.transcript_path)
+        else:
+            digest = hashlib.sha256(self.transcript.encode("utf-8")).hexdigest()
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"{digest[:32]}-v{INDEX_VERSION}-{self.size}-{self.overlap}.sqlite3")
+
+        with telemetry.span("passage_index") as span:
+            reused = os.path.exists(self.path)
+            span.set("reused", reused)
+            if not reused:
+                # Build under a private name so concurrent runs never open a half-written index.
+                building = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                self._build(building)
+                os.replace(building, self.path)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._passages, self._average_length = self._conn.execute(
+                "SELECT passages, average_length FROM meta").fetchone()
+            span.set("passages", self._passages)
+        return self._conn
+
+    def _build(self, path):
+        conn = sqlite3.connect(path)
+        conn.executescript(
+            "PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;"
+            "CREATE TABLE passages (id INTEGER PRIMARY KEY, position INTEGER NOT NULL, start TEXT NOT NULL, "
+            "end TEXT NOT NULL, text TEXT NOT NULL, length INTEGER NOT NULL);"
+            "CREATE TABLE postings (term TEXT NOT NULL, passage INTEGER NOT NULL, tf INTEGER NOT NULL);"
+            "CREATE TABLE meta (passages INTEGER NOT NULL, average_length REAL NOT NULL);"
+        )
+        count = 0
+        total_length = 0
+        for passage_id, passage in enumerate(iter_passages(self._lines(), self.size, self.overlap)):
+            text = "\n".join(passage.lines)
+            terms = Counter(tokenize(text))
+            length = sum(terms.values())
+            conn.execute("INSERT INTO passages VALUES (?, ?, ?, ?, ?, ?)",
+                         (passage_id, passage.position, passage.start, passage.end, text, length))
+            conn.executemany("INSERT INTO postings VALUES (?, ?, ?)",
+                             ((term, passage_id, tf) for term, tf in terms.items()))
+            count += 1
+            total_length += length
+        conn.execute("CREATE INDEX postings_term ON postings (term)")
+        conn.execute("INSERT INTO meta VALUES (?, ?)", (count, total_length / count if count else 0.0))
+        conn.commit()
+        conn.close()
+
+    def search(self, query, top_k=PASSAGE_TOP_K):
+        """
+        Find the passages that best match a query.
+
+        Args:
+            query (str): Free text, such as the issues a stage focuses on.
+            top_k (int): Maximum number of passages to return.
+
+        Returns:
+            list[Passage]: The best matching passages, highest score first.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            conn = self._open()
+            scores = Counter()
+            for term in terms:
+                postings = conn.execute(
+                    "SELECT postings.passage, postings.tf, passages.length FROM postings "
+                    "JOIN passages ON passages.id = postings.passage WHERE postings.term = ?", (term,)).fetchall()
+                if not postings:
+                    continue
+                idf = math.log(1 + (self._passages - len(postings) + 0.5) / (len(postings) + 0.5))
+                for passage_id, tf, length in postings:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (self._average_length or 1))
+                    scores[passage_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+            results = []
+            for passage_id, score in scores.most_common(top_k):
+                if score <= 0:
+                    break
+                position, start, end, text = conn.execute(
+                    "SELECT position, start, end, text FROM passages WHERE id = ?", (passage_id,)).fetchone()
+                results.append(Passage(position, start, end, text.split("\n"), score))
+        return results
+
+    def excerpts(self, query, top_k=PASSAGE_TOP_K):
+        """
+        Search and format the matching passages as transcript excerpts.
+
+        Passages are put back in transcript order and overlapping ones are merged,
+        so no line is sent twice.
+
+        Args:
+            query (str): Free text, such as the issues a stage focuses on.
+            top_k (int): Maximum number of passages to include.
+
+        Returns:
+            str: Excerpts headed by their page:line range, separated by "...", or "" if nothing matched.
+        """
+        with telemetry.span("passage_search", top_k=top_k) as span:
+            merged = []
+            for passage in sorted(self.search(query, top_k), key=lambda found: found.position):
+                previous = merged[-1] if merged else None
+                if previous is not None and passage.position <= previous.position + len(previous.lines):
+                    added = passage.lines[previous.position + len(previous.lines) - passage.position:]
+                    if added:
+                        previous.lines.extend(added)
+                        previous.end = passage.end
+                else:
+                    merged.append(passage)
+            span.set("excerpts", len(merged))
+            return "\n...\n".join(
+                f"(Pages {passage.start} to {passage.end})\n" + "\n".join(passage.lines) for passage in merged
+            )
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
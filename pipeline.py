@@ -0,0 +1,265 @@
+import struct
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import telemetry
+from Constants import MAX_CONCURRENT_STAGES, STREAM_BUFFER_CHARS
+from hedging import hedge_requests
+from scheduler import request_priority
+
+
+class Stage:
+    """
+    A single analysis step of the case pipeline.
+
+    Args:
+        name (str): Unique name of the stage, used as its key in the results.
+        func (callable): Function that produces the stage output.
+        args (tuple): Positional arguments passed to func when build_args is not given.
+        depends_on (tuple): Names of the stages whose outputs this stage needs.
+        build_args (callable): Optional function that receives a dict of the
+                               outputs of depends_on and returns the args tuple.
+        priority (int): Optional priority of the stage's model requests; lower is sent first.
+        hedge (HedgePolicy): Optional policy for racing slow model requests against a duplicate.
+    """
+
+    def __init__(self, name, func, args=(), depends_on=(), build_args=None, priority=None, hedge=None):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.depends_on = tuple(depends_on)
+        self.build_args = build_args
+        self.priority = priority
+        self.hedge = hedge
+
+    def run(self, *args):
+        with telemetry.context(stage=self.name), telemetry.span("stage"), request_priority(self.priority), \
+                hedge_requests(self.hedge):
+            return self.func(*args)
+
+    def resolve_args(self, results):
+        if self.build_args is None:
+            return self.args
+        return tuple(self.build_args({name: results[name] for name in self.depends_on}))
+
+
+def _check_graph(stages):
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError(f"Duplicate stage name: {stage.name}")
+        by_name[stage.name] = stage
+
+    for stage in stages:
+        for dependency in stage.depends_on:
+            if dependency not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dependency}'")
+
+    # Kahn's algorithm: every stage must become ready at some point.
+    remaining = {stage.name: set(stage.depends_on) for stage in stages}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"Stage dependency cycle among: {', '.join(sorted(remaining))}")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    return by_name
+
+
+def run_stages(stages, max_workers=MAX_CONCURRENT_STAGES, completed=None, on_complete=None):
+    """
+    Run a DAG of stages, executing independent stages concurrently.
+
+    A stage is submitted as soon as every stage it depends on has finished, so the
+    wall-clock time is bounded by the longest dependency chain rather than the sum
+    of all stages.
+
+    Args:
+        stages (list[Stage]): The stages to run.
+        max_workers (int): Maximum number of stages running at the same time.
+        completed (dict): Outputs of stages finished in an earlier run; these stages are not run again.
+        on_complete (callable): Called with (stage name, output) as each stage finishes.
+
+    Returns:
+        dict: Mapping of stage name to the value returned by its function.
+    """
+    by_name = _check_graph(stages)
+    results = {name: output for name, output in (completed or {}).items() if name in by_name}
+    pending = {name: stage for name, stage in by_name.items() if name not in results}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if all(dependency in results for dependency in stage.depends_on):
+                    del pending[name]
+                    future = executor.submit(stage.run, *stage.resolve_args(results))
+                    running[future] = name
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception:
+                    for other in running:
+                        other.cancel()
+                    raise
+                if on_complete is not None:
+                    on_complete(name, results[name])
+
+    return results
+
+
+_END_OF_STAGE = object()
+_LENGTH = struct.Struct("<I")
+
+
+class _StageBuffer:
+    """
+    Pieces of a stage's output waiting to be yielded.
+
+    Up to max_chars characters are held in memory; once that is reached, later pieces
+    are spilled to a temporary file until the reader has caught up. Writers never
+    block, so a stage that runs ahead of the one being yielded cannot hold up a worker.
+    """
+
+    def __init__(self, max_chars=STREAM_BUFFER_CHARS):
+        self.max_chars = max_chars
+        self._condition = threading.Condition()
+        self._memory = deque()
+        self._memory_chars = 0
+        self._file = None
+        self._read_offset = self._write_offset = 0
+        self._spilled = 0
+        self._ended = False
+        self._closed = False
+
+    def put(self, piece):
+        with self._condition:
+            if self._closed:
+                return
+            if not self._spilled and self._memory_chars + len(piece) <= self.max_chars:
+                self._memory.append(piece)
+                self._memory_chars += len(piece)
+            else:
+                # Once spilling has started, pieces go to the file until it is read back,
+                # so they stay in order.
+                if self._file is None:
+                    self._file = tempfile.TemporaryFile()
+                data = piece.encode("utf-8")
+                self._file.seek(self._write_offset)
+                self._file.write(_LENGTH.pack(len(data)) + data)
+                self._write_offset += _LENGTH.size + len(data)
+                self._spilled += 1
+            self._condition.notify_all()
+
+    def end(self):
+        with self._condition:
+            self._ended = True
+            self._condition.notify_all()
+
+    def get(self):
+        """Return the next piece, waiting for it, or _END_OF_STAGE once the stage has ended."""
+        with self._condition:
+            while not (self._memory or self._spilled or self._ended):
+                self._condition.wait()
+            if self._memory:
+                piece = self._memory.popleft()
+                self._memory_chars -= len(piece)
+                return piece
+            if not self._spilled:
+                return _END_OF_STAGE
+            self._file.seek(self._read_offset)
+            size, = _LENGTH.unpack(self._file.read(_LENGTH.size))
+            piece = self._file.read(size).decode("utf-8")
+            self._read_offset += _LENGTH.size + size
+            self._spilled -= 1
+            if not self._spilled:
+                # Everything spilled has been read; start filling the file from the top again.
+                self._read_offset = self._write_offset = 0
+                self._file.truncate(0)
+            return piece
+
+    def close(self):
+        """Release the temporary file; pieces put afterwards are dropped."""
+        with self._condition:
+            self._closed = True
+            self._memory.clear()
+            self._memory_chars = self._spilled = 0
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _drain_into(func, chunks, keep_text):
+    def run(*args):
+        parts = [] if keep_text else None
+        try:
+            for piece in func(*args):
+                chunks.put(piece)
+                if keep_text:
+                    parts.append(piece)
+        finally:
+            chunks.end()
+        return "".join(parts) if keep_text else None
+    return run
+
+
+def stream_stages(stages, max_workers=MAX_CONCURRENT_STAGES):
+    """
+    Run a DAG of streaming stages and yield their output in stage order.
+
+    Each stage function must return an iterable of text pieces. Stages still run
+    concurrently as in run_stages; the pieces of later stages are buffered until
+    every earlier stage has been yielded. Up to STREAM_BUFFER_CHARS characters per
+    stage are buffered in memory and the rest in a temporary file. The full text of
+    a stage is also kept in memory when another stage depends on it.
+
+    Args:
+        stages (list[Stage]): The stages to run, in the order their output is yielded.
+        max_workers (int): Maximum number of stages running at the same time.
+
+    Yields:
+        tuple: (stage name, text piece) pairs.
+    """
+    needed = {dependency for stage in stages for dependency in stage.depends_on}
+    outputs = {stage.name: _StageBuffer() for stage in stages}
+    wrapped = [
+        Stage(stage.name, _drain_into(stage.func, outputs[stage.name], stage.name in needed),
+              stage.args, stage.depends_on, stage.build_args, stage.priority, stage.hedge)
+        for stage in stages
+    ]
+    failure = []
+
+    def run():
+        try:
+            run_stages(wrapped, max_workers)
+        except BaseException as e:
+            failure.append(e)
+            # Unblock the consumer for stages that never started.
+            for chunks in outputs.values():
+                chunks.end()
+
+    runner = threading.Thread(target=run, daemon=True)
+    runner.start()
+    try:
+        for stage in stages:
+            chunks = outputs[stage.name]
+            while True:
+                piece = chunks.get()
+                if piece is _END_OF_STAGE:
+                    break
+                yield stage.name, piece
+            chunks.close()
+            if failure:
+                break
+        runner.join()
+    finally:
+        for chunks in outputs.values():
+            chunks.close()
+    if failure:
+        raise failure[0]
@@ -0,0 +1,250 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+import openai
+import telemetry
+from Constants import (
+    REQUESTS_PER_MINUTE,
+    TOKENS_PER_MINUTE,
+    MAX_RETRIES,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    DEFAULT_PRIORITY,
+)
+from tokens import count_message_tokens
+
+TRANSIENT_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
+_local = threading.local()
+
+
+class RequestCancelledError(RuntimeError):
+    """Raised by RequestScheduler.call instead of sending or retrying a request whose caller cancelled it."""
+
+
+@contextmanager
+def request_priority(priority):
+    """
+    Set the priority of model requests made by the current thread.
+
+    Lower numbers are served first when requests queue for rate limit budget.
+    """
+    previous = getattr(_local, "priority", None)
+    _local.priority = priority
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def current_priority():
+    """Return the priority set with request_priority for the current thread."""
+    priority = getattr(_local, "priority", None)
+    return DEFAULT_PRIORITY if priority is None else priority
+
+
+def estimate_tokens(messages, max_tokens, model=None):
+    """
+    Estimate how many tokens a request counts against the tokens-per-minute limit.
+
+    The limit is charged for the prompt plus the requested max_tokens, so both are included.
+    """
+    return count_message_tokens(messages, model) + max_tokens
+
+
+def is_transient(error):
+    """Return True for errors worth retrying: throttling, timeouts, connection and server errors."""
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    if isinstance(error, openai.error.APIError):
+        return error.http_status is None or error.http_status >= 500
+    return False
+
+
+def retry_after(error):
+    """Return the delay in seconds requested by the Retry-After header of an error, if any."""
+    headers = getattr(error, "headers", None) or {}
+    for name in ("retry-after-ms", "Retry-After-Ms", "retry-after", "Retry-After"):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            delay = float(value)
+        except (TypeError, ValueError):
+            continue
+        return delay / 1000 if name.lower().endswith("-ms") else delay
+    return None
+
+
+class TokenBucket:
+    """
+    Token bucket holding up to a minute's worth of budget, refilled continuously.
+
+    Args:
+        per_minute (float): Budget granted per minute.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount can be taken; requests larger than the bucket wait for a full bucket."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def take(self, amount):
+        self.available -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        self.available = min(self.capacity, self.available + amount)
+
+
+class RequestScheduler:
+    """
+    Central scheduler shared by every model request.
+
+    Requests wait for requests-per-minute and tokens-per-minute budget in priority
+    order, and transient failures are retried with jittered exponential backoff that
+    honours Retry-After. A rate-limit response pauses all queued requests until the
+    requested delay has passed, instead of letting them fail one by one.
+
+    Args:
+        requests_per_minute (int): Request budget per minute.
+        tokens_per_minute (int): Token budget per minute.
+        max_retries (int): Retries of a transient failure before giving up.
+        base_delay (float): Initial backoff delay in seconds.
+        max_delay (float): Upper bound for a single backoff delay in seconds.
+    """
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 max_retries=MAX_RETRIES, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.throttled = 0
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._paused_until = 0.0
+        self._waiters = []
+        self._tickets = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, tokens, priority=None):
+        """
+        Block until the request budget allows a request of the given size.
+
+        Args:
+            tokens (int): Estimated tokens of the request.
+            priority (int): Lower numbers are served first; defaults to current_priority().
+
+        Returns:
+            float: Seconds spent waiting in the queue.
+        """
+        if priority is None:
+            priority = current_priority()
+        started = time.monotonic()
+        ticket = (priority, next(self._tickets))
+        with self._condition:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    if self._waiters[0] != ticket:
+                        self._condition.wait()
+                        continue
+                    now = time.monotonic()
+                    delay = max(
+                        self._paused_until - now,
+                        self._requests.wait_time(1, now),
+                        self._tokens.wait_time(tokens, now),
+                    )
+                    if delay <= 0:
+                        self._requests.take(1)
+                        self._tokens.take(tokens)
+                        return now - started
+                    self._condition.wait(delay)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+
+    def settle(self, estimated, actual):
+        """Return the unused part of a request's token estimate once its real usage is known."""
+        if actual is None or actual >= estimated:
+            return
+        with self._condition:
+            self._tokens.give_back(estimated - actual)
+            self._condition.notify_all()
+
+    def pause(self, seconds):
+        """Hold back every queued request for the given number of seconds."""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff delay for the given retry attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, func, tokens, priority=None, span=telemetry.NOOP_SPAN, cancelled=None):
+        """
+        Run func once budget is available, retrying transient failures.
+
+        Args:
+            func (callable): Function sending the request.
+            tokens (int): Estimated tokens of the request.
+            priority (int): Lower numbers are served first; defaults to current_priority().
+            span (Span): Telemetry span that receives queue wait and retry counts.
+            cancelled (threading.Event): Optional; once it is set the request is neither sent
+                                         nor retried, and a backoff in progress ends early.
+
+        Returns:
+            The value returned by func.
+
+        Raises:
+            RequestCancelledError: If cancelled was set before the request could be sent.
+        """
+        attempt = 0
+        while True:
+            span.add("queue_wait_seconds", self.acquire(tokens, priority))
+            if cancelled is not None and cancelled.is_set():
+                self.settle(tokens, 0)
+                raise RequestCancelledError("The request was cancelled before it was sent.")
+            try:
+                return func()
+            except Exception as e:
+                if not is_transient(e) or attempt >= self.max_retries:
+                    raise
+                if cancelled is not None and cancelled.is_set():
+                    raise
+                requested = retry_after(e)
+                delay = requested if requested is not None else self.backoff(attempt)
+                if isinstance(e, openai.error.RateLimitError):
+                    self.throttled += 1
+                    self.pause(delay)
+                self.retries += 1
+                span.add("retries", 1)
+                attempt += 1
+                if cancelled is not None:
+                    cancelled.wait(delay)
+                else:
+                    time.sleep(delay)
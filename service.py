@@ -0,0 +1,188 @@
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import telemetry
+from Constants import (BATCH_WORKERS, BATCH_OUTPUT_DIR, CHECKPOINT_DIR, SERVICE_HOST, SERVICE_MAX_FINISHED_JOBS,
+                       SERVICE_PORT)
+from batch import process_case
+from client import get_backend
+
+
+class CaseService:
+    """
+    Long-running worker pool that accepts case jobs without per-job process startup.
+
+    The model backend, its pooled HTTP session, the response cache and the request
+    scheduler are created once and shared by every job.
+
+    Args:
+        workers (int): Number of cases processed at the same time.
+        output_dir (str): Directory for the generated .docx documents.
+        checkpoint_dir (str): Directory for the per-case checkpoints.
+        max_finished_jobs (int): Finished jobs kept for GET /jobs/<id>; older ones are forgotten.
+    """
+
+    def __init__(self, workers=BATCH_WORKERS, output_dir=BATCH_OUTPUT_DIR, checkpoint_dir=CHECKPOINT_DIR,
+                 max_finished_jobs=SERVICE_MAX_FINISHED_JOBS):
+        self.output_dir = output_dir
+        self.checkpoint_dir = checkpoint_dir
+        self.max_finished_jobs = max_finished_jobs
+        os.makedirs(output_dir, exist_ok=True)
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        # Open the backend's connection pool now rather than on the first job.
+        get_backend()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._jobs = {}
+        # Ids of finished jobs, oldest first.
+        self._finished = deque()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, case):
+        """
+        Queue a case for processing.
+
+        Args:
+            case (dict): Case record with the keys accepted by build_case_stages.
+
+        Returns:
+            dict: The job record, with its id and status.
+        """
+        with self._lock:
+            job_id = str(next(self._ids))
+            case.setdefault("case_id", f"job-{job_id}")
+            job = {"id": job_id, "case_id": case["case_id"], "status": "queued", "submitted": time.time()}
+            # The future is set before the job is published, so get() can always wait on it.
+            job["_future"] = self._executor.submit(self._run, job, case)
+            self._jobs[job_id] = job
+        return job
+
+    def _run(self, job, case):
+        # Jobs are only changed under the lock, so get() never copies one midway.
+        with self._lock:
+            job["status"] = "running"
+            job["started"] = time.time()
+        try:
+            result = process_case(case, self.output_dir, self.checkpoint_dir)
+            update = {"result": result, "status": result["status"]}
+        except Exception as e:
+            update = {"status": "failed", "error": str(e)}
+        with self._lock:
+            job.update(update, finished=time.time())
+            self._finished.append(job["id"])
+            while len(self._finished) > self.max_finished_jobs:
+                del self._jobs[self._finished.popleft()]
+
+    def get(self, job_id, wait=False):
+        """Return the public fields of a job, optionally waiting for it to finish; None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if wait:
+            job["_future"].result()
+        with self._lock:
+            return {key: value for key, value in job.items() if not key.startswith("_")}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps client connections alive between requests.
+    protocol_version = "HTTP/1.1"
+    service = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            self._send(200, {"status": "ok"})
+        elif url.path == "/metrics":
+            self._send(200, telemetry.prometheus_text(), "text/plain; version=0.0.4")
+        elif url.path.startswith("/jobs/"):
+            wait = parse_qs(url.query).get("wait") == ["1"]
+            job = self.service.get(url.path[len("/jobs/"):], wait=wait)
+            if job is None:
+                self._send(404, {"error": "unknown job"})
+            else:
+                self._send(200, job)
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/jobs":
+            self._send(404, {"error": "not found"})
+            return
+        try:
+            case = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError:
+            case = None
+        if not isinstance(case, dict):
+            self._send(400, {"error": "body must be a JSON case record"})
+            return
+        job = self.service.submit(case)
+        if parse_qs(url.query).get("wait") == ["1"]:
+            self._send(200, self.service.get(job["id"], wait=True))
+        else:
+            self._send(202, self.service.get(job["id"]))
+
+
+def serve(service, host=SERVICE_HOST, port=SERVICE_PORT):
+    """
+    Create the HTTP server for a CaseService.
+
+    Endpoints:
+        POST /jobs          Submit a case record; add ?wait=1 to respond when it finishes.
+        GET  /jobs/<id>     Job status and result; add ?wait=1 to wait for it to finish.
+        GET  /health        Liveness check.
+        GET  /metrics       Telemetry in the Prometheus text format.
+
+    Returns:
+        ThreadingHTTPServer: The server; call serve_forever() to run it.
+    """
+    handler = type("CaseHandler", (_Handler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the case analysis pipeline as a long-running HTTP service.")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="cases processed at the same time")
+    parser.add_argument("--output-dir", default=BATCH_OUTPUT_DIR, help="directory for the .docx documents")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR, help="directory for per-case checkpoints")
+    args = parser.parse_args(argv)
+
+    service = CaseService(args.workers, args.output_dir, args.checkpoint_dir)
+    server = serve(service, args.host, args.port)
+    print(f"Serving case jobs on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import threading
+
+
+class LeaderAbandonedError(RuntimeError):
+    """Raised to requests sharing a stream when the request that opened it stops reading it."""
+
+
+class _Call:
+    __slots__ = ("pieces", "result", "error", "done", "condition")
+
+    def __init__(self, lock):
+        self.pieces = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self.condition = threading.Condition(lock)
+
+
+class SingleFlight:
+    """
+    Coalesce identical requests that are in flight at the same time.
+
+    The first caller for a key runs the request. Callers that arrive with the same key
+    before it finishes do not send their own: they wait for its result, or, for a stream,
+    replay the pieces received so far and then follow it as it is generated.
+
+    Attributes:
+        leaders (int): Requests that were actually run.
+        coalesced (int): Requests served by another caller's request.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = _Call(self._lock)
+            self._calls[key] = call
+            self.leaders += 1
+            return call, True
+
+    def _finish(self, key, call, result=None, error=None):
+        with self._lock:
+            if call.done:
+                return
+            call.result = result
+            call.error = error
+            call.done = True
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            call.condition.notify_all()
+
+    def do(self, key, func):
+        """
+        Run func, unless an identical request is already running; then share its result.
+
+        Args:
+            key (str): Identity of the request, e.g. a hash of its parameters.
+            func (callable): Sends the request and returns its result.
+
+        Returns:
+            tuple: The result, and True if it came from another caller's request.
+        """
+        call, leader = self._join(key)
+        if leader:
+            try:
+                result = func()
+            except BaseException as e:
+                self._finish(key, call, error=e)
+                raise
+            self._finish(key, call, result=result)
+            return result, False
+
+        with self._lock:
+            while not call.done:
+                call.condition.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    def stream(self, key, open_stream):
+        """
+        Open a stream, unless an identical one is already running; then follow that one.
+
+        Args:
+            key (str): Identity of the request, e.g. a hash of its parameters.
+            open_stream (callable): Returns an iterator of the pieces of the response.
+
+        Returns:
+            tuple: An iterator of the pieces, and True if they come from another caller's stream.
+                   Like a generator, the iterator returns the return value of the opened
+                   stream, e.g. its finish reason, when it is exhausted.
+        """
+        call, leader = self._join(key)
+        if leader:
+            return _LeaderStream(self, key, call, self._lead(key, call, open_stream)), False
+        return self._follow(call), True
+
+    def _lead(self, key, call, open_stream):
+        try:
+            pieces = open_stream()
+            while True:
+                try:
+                    piece = next(pieces)
+                except StopIteration as stop:
+                    result = stop.value
+                    break
+                with self._lock:
+                    call.pieces.append(piece)
+                    call.condition.notify_all()
+                yield piece
+        except GeneratorExit:
+            self._finish(key, call, error=LeaderAbandonedError("The shared stream was closed before it finished."))
+            raise
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            raise
+        self._finish(key, call, result=result)
+        return result
+
+    def _follow(self, call):
+        position = 0
+        while True:
+            with self._lock:
+                while position >= len(call.pieces) and not call.done:
+                    call.condition.wait()
+                available = call.pieces[position:]
+                done = call.done
+            position += len(available)
+            yield from available
+            if done:
+                if call.error is not None:
+                    raise call.error
+                return call.result
+
+    def stats(self):
+        """Return the leaders and coalesced counters and the number of requests in flight."""
+        with self._lock:
+            return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+class _LeaderStream:
+    """
+    The leader's side of a shared stream.
+
+    A generator that is closed or dropped before its first next() runs none of its
+    code, so closing it alone would leave the key registered and its followers
+    waiting forever. This iterator always finishes the call when it is closed.
+    """
+
+    def __init__(self, flight, key, call, pieces):
+        self._flight = flight
+        self._key = key
+        self._call = call
+        self._pieces = pieces
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._pieces)
+
+    def close(self):
+        self._pieces.close()
+        # Does nothing if the stream already finished.
+        self._flight._finish(self._key, self._call,
+                             error=LeaderAbandonedError("The shared stream was closed before it finished."))
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,308 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from Constants import MODEL_PRICING, TELEMETRY_MAX_SPANS
+
+# Read from TELEMETRY on first use, so a .env loaded after this module is imported still applies.
+_enabled = None
+_spans = deque(maxlen=TELEMETRY_MAX_SPANS)
+# Running count, duration, error and counter totals per span name and labels, kept for every span.
+_totals = {}
+_spans_lock = threading.Lock()
+_local = threading.local()
+
+# Attributes summed per span name and labels in the metrics export.
+COUNTED_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "cost_usd", "retries", "hedges", "continuations",
+                      "queue_wait_seconds")
+SUMMARY_QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Span:
+    """
+    A timed operation with attributes, recorded when it ends.
+
+    Attributes:
+        name (str): Kind of operation, e.g. "model_call" or "render_document".
+        attributes (dict): Labels and measurements of the operation.
+        start (float): Wall-clock start time.
+        duration (float): Seconds the operation took, set when it ends.
+    """
+
+    __slots__ = ("name", "attributes", "start", "duration", "_started")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+        self._started = time.perf_counter()
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, key, amount):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def elapsed(self):
+        """Seconds since the span started."""
+        return time.perf_counter() - self._started
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.duration = self.elapsed()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        key = (self.name, _label_key(self))
+        with _spans_lock:
+            _spans.append(self)
+            totals = _totals.get(key)
+            if totals is None:
+                totals = _totals[key] = {"count": 0, "seconds": 0.0, "errors": 0,
+                                         "counted": dict.fromkeys(COUNTED_ATTRIBUTES, 0)}
+            totals["count"] += 1
+            totals["seconds"] += self.duration
+            totals["errors"] += "error" in self.attributes
+            for name in COUNTED_ATTRIBUTES:
+                totals["counted"][name] += self.attributes.get(name, 0) or 0
+        return False
+
+
+class _NoopSpan:
+    """Stand-in returned while telemetry is disabled; every hook does nothing."""
+
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def add(self, key, amount):
+        pass
+
+    def elapsed(self):
+        return 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _Context:
+    __slots__ = ("attributes", "previous")
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.previous = getattr(_local, "context", None)
+        _local.context = dict(self.previous or {}, **self.attributes)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        _local.context = self.previous
+        return False
+
+
+def enable(enabled=True):
+    """Switch span recording on or off; it starts switched on when TELEMETRY=on."""
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    global _enabled
+    if _enabled is None:
+        _enabled = os.getenv("TELEMETRY", "off").lower() in ("on", "1", "true", "yes")
+    return _enabled
+
+
+def reset():
+    """Discard all recorded spans and totals."""
+    with _spans_lock:
+        _spans.clear()
+        _totals.clear()
+
+
+def span(name, **attributes):
+    """
+    Start a span, used as a context manager.
+
+    Attributes set with context() on the current thread are added to the span.
+    While telemetry is disabled a shared no-op span is returned.
+    """
+    if not is_enabled():
+        return NOOP_SPAN
+    context = getattr(_local, "context", None)
+    if context:
+        attributes = dict(context, **attributes)
+    return Span(name, attributes)
+
+
+def context(**attributes):
+    """Attach attributes, such as the stage name, to every span started by the current thread."""
+    if not is_enabled():
+        return NOOP_SPAN
+    return _Context(attributes)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """Estimated cost in USD of a request, from MODEL_PRICING (USD per million tokens)."""
+    pricing = None
+    for name in sorted(MODEL_PRICING, key=len, reverse=True):
+        if model.startswith(name):
+            pricing = MODEL_PRICING[name]
+            break
+    if pricing is None:
+        return 0.0
+    return (prompt_tokens * pricing["input"] + completion_tokens * pricing["output"]) / 1_000_000
+
+
+def get_spans():
+    """Return the most recent TELEMETRY_MAX_SPANS recorded spans."""
+    with _spans_lock:
+        return list(_spans)
+
+
+def _percentile(ordered, fraction):
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _label_key(recorded):
+    labels = {}
+    for key in ("stage", "model", "cache"):
+        if key in recorded.attributes:
+            labels[key] = str(recorded.attributes[key])
+    return tuple(sorted(labels.items()))
+
+
+def _aggregate():
+    # Totals cover every span; latency quantiles only the spans still kept.
+    with _spans_lock:
+        spans = list(_spans)
+        groups = {
+            key: {"count": totals["count"], "seconds": totals["seconds"], "errors": totals["errors"],
+                  "totals": dict(totals["counted"]), "durations": [], "first_token": []}
+            for key, totals in _totals.items()
+        }
+    for recorded in spans:
+        group = groups[(recorded.name, _label_key(recorded))]
+        group["durations"].append(recorded.duration)
+        if "time_to_first_token" in recorded.attributes:
+            group["first_token"].append(recorded.attributes["time_to_first_token"])
+    for group in groups.values():
+        group["durations"].sort()
+        group["first_token"].sort()
+    return spans, groups
+
+
+def run_report():
+    """
+    Build a JSON-serializable report of every recorded span plus per-operation aggregates.
+
+    Returns:
+        dict: "spans" with the most recent TELEMETRY_MAX_SPANS spans, and "summary" with
+              counts, latency percentiles and token, cost, retry, hedge, continuation and
+              queue-wait totals per span name and labels.
+    """
+    spans, groups = _aggregate()
+    summary = []
+    for (name, labels), group in sorted(groups.items()):
+        durations = group["durations"]
+        entry = {
+            "name": name,
+            "labels": dict(labels),
+            "count": group["count"],
+            "errors": group["errors"],
+            "latency_seconds_total": round(group["seconds"], 6),
+        }
+        if durations:
+            entry["latency_seconds"] = {
+                f"p{int(q * 100)}": round(_percentile(durations, q), 6) for q in SUMMARY_QUANTILES
+            }
+        if group["first_token"]:
+            first_token = group["first_token"]
+            entry["time_to_first_token_seconds"] = {
+                f"p{int(q * 100)}": round(_percentile(first_token, q), 6) for q in SUMMARY_QUANTILES
+            }
+        entry.update({key: round(value, 6) for key, value in group["totals"].items()})
+        summary.append(entry)
+    return {
+        "spans": [
+            {"name": recorded.name, "start": recorded.start, "duration": recorded.duration, **recorded.attributes}
+            for recorded in spans
+        ],
+        "summary": summary,
+    }
+
+
+def write_json_report(path):
+    """Write run_report() to a JSON file."""
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(run_report(), handle, indent=2, default=str)
+
+
+def _labels_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def prometheus_text():
+    """
+    Render the recorded spans in the Prometheus text exposition format.
+
+    Every span name becomes a <name>_seconds summary and an <name>_errors_total
+    counter; token, cost, retry, hedge, continuation and queue-wait totals become counters.
+    Quantiles are taken over the most recent TELEMETRY_MAX_SPANS spans.
+    """
+    lines = []
+    _, groups = _aggregate()
+    for name in sorted({name for name, _ in groups}):
+        metric = f"draft_{name}"
+        lines.append(f"# HELP {metric}_seconds Duration of {name} operations.")
+        lines.append(f"# TYPE {metric}_seconds summary")
+        for (group_name, labels), group in sorted(groups.items()):
+            if group_name != name:
+                continue
+            durations = group["durations"]
+            for quantile in SUMMARY_QUANTILES if durations else ():
+                lines.append(f"{metric}_seconds{_labels_text(labels, [('quantile', quantile)])} "
+                             f"{_percentile(durations, quantile):.6f}")
+            lines.append(f"{metric}_seconds_sum{_labels_text(labels)} {group['seconds']:.6f}")
+            lines.append(f"{metric}_seconds_count{_labels_text(labels)} {group['count']}")
+
+        lines.append(f"# TYPE {metric}_errors_total counter")
+        for (group_name, labels), group in sorted(groups.items()):
+            if group_name == name:
+                lines.append(f"{metric}_errors_total{_labels_text(labels)} {group['errors']}")
+
+        for key in COUNTED_ATTRIBUTES:
+            values = [(labels, group["totals"][key]) for (group_name, labels), group in sorted(groups.items())
+                      if group_name == name and group["totals"][key]]
+            if not values:
+                continue
+            counter = f"{metric}_{key}" if key.endswith("seconds") else f"{metric}_{key}_total"
+            lines.append(f"# TYPE {counter} counter")
+            for labels, value in values:
+                lines.append(f"{counter}{_labels_text(labels)} {value:.6f}" if isinstance(value, float)
+                             else f"{counter}{_labels_text(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    """Write prometheus_text() to a file, e.g. for the node exporter textfile collector."""
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write(prometheus_text())
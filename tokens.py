@@ -0,0 +1,89 @@
+import math
+from Constants import MODEL_LIMITS, DEFAULT_MODEL_LIMITS, MIN_OUTPUT_TOKENS, CONTEXT_SAFETY_MARGIN
+
+try:
+    import tiktoken
+except ImportError:  # Optional: fall back to a conservative character-based estimate.
+    tiktoken = None
+
+# Tokens added by the chat format for every message and for priming the reply.
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+_encodings = {}
+
+
+class ContextWindowExceededError(ValueError):
+    """Raised when a request cannot fit in the model's context window with a useful reply."""
+
+
+def model_limits(model):
+    """
+    Look up the context window and output limit of a model.
+
+    Returns:
+        dict: context_window and max_output_tokens for the model.
+    """
+    if model in MODEL_LIMITS:
+        return MODEL_LIMITS[model]
+    # Dated snapshots such as gpt-4o-2024-08-06 share the limits of their family.
+    for name in sorted(MODEL_LIMITS, key=len, reverse=True):
+        if model.startswith(name):
+            return MODEL_LIMITS[name]
+    return DEFAULT_MODEL_LIMITS
+
+
+def _encoding(model):
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("o200k_base")
+    return _encodings[model]
+
+
+def count_tokens(text, model=None):
+    """
+    Count the tokens of a text locally.
+
+    Uses tiktoken when it is installed; otherwise estimates 3.5 characters per token,
+    which overestimates for English prose so budgets stay on the safe side.
+    """
+    if tiktoken is not None and model is not None:
+        return len(_encoding(model).encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 3.5)
+
+
+def count_message_tokens(messages, model=None):
+    """Count the prompt tokens of a list of chat messages."""
+    total = TOKENS_PER_REPLY
+    for message in messages:
+        total += TOKENS_PER_MESSAGE + count_tokens(message["content"], model)
+    return total
+
+
+def budget_max_tokens(model, messages, requested, minimum=MIN_OUTPUT_TOKENS):
+    """
+    Work out the max_tokens that actually fits for a request.
+
+    Args:
+        model (str): Model name.
+        messages (list): Chat messages to send.
+        requested (int): The completion token limit asked for.
+        minimum (int): Smallest useful completion; requests that cannot get it are rejected.
+
+    Returns:
+        int: requested, reduced to the room left in the context window and the model's output limit.
+
+    Raises:
+        ContextWindowExceededError: If fewer than minimum tokens are left for the completion.
+    """
+    limits = model_limits(model)
+    prompt_tokens = count_message_tokens(messages, model)
+    available = limits["context_window"] - prompt_tokens - CONTEXT_SAFETY_MARGIN
+    if available < min(minimum, requested):
+        raise ContextWindowExceededError(
+            f"The prompt uses about {prompt_tokens} tokens, leaving {max(available, 0)} of the "
+            f"{limits['context_window']}-token context window of {model} for the response."
+        )
+    return min(requested, available, limits["max_output_tokens"])
@@ -0,0 +1,199 @@
+import mmap
+import re
+from Constants import TRANSCRIPT_CHUNK_CHARS, TRANSCRIPT_CHUNK_OVERLAP_LINES
+
+PAGE_HEADER = re.compile(r"^\s*Page\s+(\d+)(?:\s+of\s+\d+)?\s*$", re.IGNORECASE)
+NUMBERED_LINE = re.compile(r"^\s*(\d{1,2})(?:\s+(.*))?$")
+SPEAKER_TURN = re.compile(r"^(?:Q\.|A\.|Q:|A:|[A-Z][A-Z .'\-]{1,40}:)")
+
+
+class TranscriptLine:
+    """A single transcript line anchored to its page and line number."""
+
+    __slots__ = ("page", "line", "text", "page_start", "speaker_turn")
+
+    def __init__(self, page, line, text, page_start, speaker_turn):
+        self.page = page
+        self.line = line
+        self.text = text
+        self.page_start = page_start
+        self.speaker_turn = speaker_turn
+
+    @property
+    def anchor(self):
+        return f"{self.page}:{self.line}"
+
+    def render(self):
+        return f"[{self.anchor}] {self.text}"
+
+
+class TranscriptChunk:
+    """
+    A contiguous excerpt of a transcript.
+
+    Attributes:
+        index (int): Position of the chunk in the transcript, starting at 0.
+        start (str): page:line anchor of the first line.
+        end (str): page:line anchor of the last line.
+        text (str): The excerpt with every line prefixed by its [page:line] anchor.
+    """
+
+    def __init__(self, index, lines):
+        self.index = index
+        self.start = lines[0].anchor
+        self.end = lines[-1].anchor
+        self.text = "\n".join(line.render() for line in lines)
+
+
+def _iter_raw_lines(path):
+    with open(path, "rb") as handle:
+        try:
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be memory-mapped.
+            return
+        with mapped:
+            for raw in iter(mapped.readline, b""):
+                yield raw.decode("utf-8", errors="replace")
+
+
+def iter_transcript_lines(path):
+    """
+    Stream a transcript file line by line, tracking page and line numbers.
+
+    Args:
+        path (str): Path of the transcript text file.
+
+    Yields:
+        TranscriptLine: Each non-blank line of the transcript.
+    """
+    return parse_transcript_lines(_iter_raw_lines(path))
+
+
+def _leading_number(text):
+    numbered = NUMBERED_LINE.match(text)
+    return int(numbered.group(1)) if numbered else None
+
+
+def parse_transcript_lines(raw_lines):
+    """
+    Anchor raw transcript lines to their page and line numbers.
+
+    Pages start at a form feed or a line that is only a "Page N" header. Leading
+    numbers are taken as the line reference only where they count up line by
+    line, starting from a line 1 that is followed by a line 2; otherwise lines are
+    counted within the page and leading numbers are kept as text.
+
+    Args:
+        raw_lines (iterable): Lines of transcript text.
+
+    Yields:
+        TranscriptLine: Each non-blank line of the transcript.
+    """
+    page = 1
+    line_number = 0
+    page_start = True
+    # Last line number read from the text on this page, or None if the page is not numbered.
+    numbered = None
+    raw_lines = iter(raw_lines)
+    following = next(raw_lines, None)
+    while following is not None:
+        raw, following = following, next(raw_lines, None)
+        if "\f" in raw:
+            page += 1
+            line_number = 0
+            page_start = True
+            numbered = None
+            raw = raw.replace("\f", "")
+
+        text = raw.rstrip("\r\n")
+        header = PAGE_HEADER.match(text)
+        if header:
+            page = int(header.group(1))
+            line_number = 0
+            page_start = True
+            numbered = None
+            continue
+
+        number = _leading_number(text)
+        if number is not None and (
+                numbered is not None and number == numbered + 1
+                or number == 1 and following is not None and "\f" not in following
+                and _leading_number(following) == 2):
+            # Numbering may also restart at 1 on a page not marked by a form feed or header.
+            numbered = line_number = number
+            text = NUMBERED_LINE.match(text).group(2) or ""
+        else:
+            line_number += 1
+        text = text.strip()
+        if not text:
+            continue
+
+        yield TranscriptLine(page, line_number, text, page_start, bool(SPEAKER_TURN.match(text)))
+        page_start = False
+
+
+def _split_point(buffer):
+    # Prefer cutting at the last page boundary, then the last speaker turn, as long
+    # as the cut keeps at least half of the buffer in the current chunk.
+    half = max(1, len(buffer) // 2)
+    for attribute in ("page_start", "speaker_turn"):
+        for position in range(len(buffer) - 1, half - 1, -1):
+            if getattr(buffer[position], attribute):
+                return position
+    return len(buffer)
+
+
+def iter_transcript_chunks(path, max_chars=TRANSCRIPT_CHUNK_CHARS, overlap_lines=TRANSCRIPT_CHUNK_OVERLAP_LINES):
+    """
+    Split a transcript file into overlapping chunks on page and speaker boundaries.
+
+    The file is memory-mapped and consumed incrementally, so only the chunk being
+    built is held in memory.
+
+    Args:
+        path (str): Path of the transcript text file.
+        max_chars (int): Target maximum size of a chunk's text.
+        overlap_lines (int): Number of lines repeated at the start of the next chunk.
+
+    Yields:
+        TranscriptChunk: The transcript chunks in order.
+    """
+    return chunk_transcript_lines(iter_transcript_lines(path), max_chars, overlap_lines)
+
+
+def iter_text_chunks(text, max_chars=TRANSCRIPT_CHUNK_CHARS, overlap_lines=TRANSCRIPT_CHUNK_OVERLAP_LINES):
+    """Split a transcript already held in a string into chunks, like iter_transcript_chunks."""
+    return chunk_transcript_lines(parse_transcript_lines(text.splitlines()), max_chars, overlap_lines)
+
+
+def chunk_transcript_lines(lines, max_chars=TRANSCRIPT_CHUNK_CHARS, overlap_lines=TRANSCRIPT_CHUNK_OVERLAP_LINES):
+    """
+    Group anchored transcript lines into overlapping chunks.
+
+    Args:
+        lines (iterable): TranscriptLine objects in order.
+        max_chars (int): Target maximum size of a chunk's text.
+        overlap_lines (int): Number of lines repeated at the start of the next chunk.
+
+    Yields:
+        TranscriptChunk: The transcript chunks in order.
+    """
+    buffer = []
+    size = 0
+    index = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line.text) + 12
+        if size < max_chars:
+            continue
+
+        cut = _split_point(buffer)
+        yield TranscriptChunk(index, buffer[:cut])
+        index += 1
+        carry = max(1, cut - overlap_lines)
+        buffer = buffer[carry:]
+        size = sum(len(kept.text) + 12 for kept in buffer)
+
+    if buffer:
+        yield TranscriptChunk(index, buffer)